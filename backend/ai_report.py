@@ -1,17 +1,27 @@
 import os
-from google import genai
-from markdown_pdf import MarkdownPdf
-from markdown_pdf import Section
-import random
 import datetime
+import logging
+import logs
+from report_store import atomic_path, new_report_name
 
+MODEL = "gemini-2.5-flash"
 
-def generate(data):
-    print(data)
-    client = genai.Client()
+log = logs.get("ai_report")
 
-    model = "gemini-2.5-flash"
+client = None
 
+
+def get_client():
+    global client
+    if client is None:
+        # google.genai is slow to import; only processes that call the LLM pay for it.
+        from google import genai
+
+        client = genai.Client()
+    return client
+
+
+def build_contents(data):
     prompt = f"""
         Task:data.get("language","English")
         Generate a detailed analytical report based on all the data provided to you above in {data.get("language","English")} language.
@@ -37,31 +47,67 @@ def generate(data):
         Strictly follow markdown format, the response should feel like a report with proper headings.
     """
 
-    response = client.models.generate_content(
-        model=model,
-        contents=str(data) + f"\n\n{prompt}"
+    return str(data) + f"\n\n{prompt}"
+
+
+def generate_markdown(data, llm_client=None):
+    llm_client = llm_client or get_client()
+
+    response = llm_client.models.generate_content(
+        model=MODEL,
+        contents=build_contents(data)
     )
-    print(response.text)
+    logs.event(log, "llm_response", chars=len(response.text or ""))
+
+    return str(response.text)
+
 
-    markdown_content = str(response.text)
+async def agenerate_markdown(data, llm_client=None):
+    llm_client = llm_client or get_client()
+
+    response = await llm_client.aio.models.generate_content(
+        model=MODEL,
+        contents=build_contents(data)
+    )
 
+    return str(response.text)
+
+
+async def astream_markdown(data, llm_client=None):
+    llm_client = llm_client or get_client()
+
+    stream = await llm_client.aio.models.generate_content_stream(
+        model=MODEL,
+        contents=build_contents(data)
+    )
+    async for chunk in stream:
+        if chunk.text:
+            yield chunk.text
+
+
+def render_report(markdown_content, name, directory="static"):
     try:
+        from markdown_pdf import MarkdownPdf, Section
+
         pdf = MarkdownPdf()
         pdf.add_section(Section(markdown_content))
 
-        rand_flag = True
-        rnd = 0
-        while rand_flag:
-            rnd = random.randint(1, 1000000000000)
-            if f"report_{rnd}" not in os.listdir("static"):
-                break
+        path = os.path.join(directory, f"{name}.pdf")
+        with atomic_path(path) as tmp_path:
+            pdf.save(tmp_path)
+        return path
 
-        pdf.save(f"static/report_{rnd}.pdf")
-        return f"static/report_{rnd}.pdf"
-    
     except Exception as e:
-        print(f"Error generating PDF: {e}")
+        logs.event(log, "pdf_render_failed", logging.WARNING, error=str(e))
         # Fallback: save as text file
-        with open(f"static/report_{rnd}.txt", 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
-        return f"static/report_{rnd}.txt"
+        path = os.path.join(directory, f"{name}.txt")
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(markdown_content)
+        return path
+
+
+def generate(data, llm_client=None):
+    markdown_content = generate_markdown(data, llm_client)
+
+    return render_report(markdown_content, new_report_name())
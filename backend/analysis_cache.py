@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import boot
+import numpy as np
+import logs
+import orjson
+
+# Bounded LRU/TTL cache of per-sample analyses. Keys hash the model, its
+# sha256, the options that change the result and the parsed float64 feature
+# row, so aliases, blanks and defaults that parse to the same row share an
+# entry. Values are kept as orjson bytes: the budget counts real bytes and
+# every hit hands out a fresh copy.
+#
+#   AIGIS_ANALYSIS_CACHE_MB=64        in-process budget (0 disables the cache)
+#   AIGIS_ANALYSIS_CACHE_TTL=3600     seconds
+#   AIGIS_ANALYSIS_CACHE_SHARED=/dev/shm/aigis-cache.sqlite
+#                                     optional second level shared by workers
+
+MAX_BYTES = int(float(os.environ.get("AIGIS_ANALYSIS_CACHE_MB", "64")) * 1024 * 1024)
+TTL = float(os.environ.get("AIGIS_ANALYSIS_CACHE_TTL", "3600"))
+SHARED_PATH = os.environ.get("AIGIS_ANALYSIS_CACHE_SHARED")
+SHARED_MAX_ENTRIES = int(os.environ.get("AIGIS_ANALYSIS_CACHE_SHARED_ENTRIES", "100000"))
+# How many shared puts go by between trims of the shared table.
+SHARED_TRIM_EVERY = 256
+
+log = logs.get("analysis_cache")
+
+
+def cache_key(model, model_hash, row, *options):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, model_hash, *options):
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    # + 0.0 folds -0.0 into 0.0.
+    digest.update((np.asarray(row, dtype=np.float64).ravel() + 0.0).tobytes())
+    return digest.digest()
+
+
+class SharedCache:
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Per-process connection, as connections do not survive a fork.
+        self.db = boot.PerProcess(self._open)
+        self.puts = 0
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=1.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " key BLOB PRIMARY KEY, expires REAL NOT NULL, body BLOB NOT NULL)"
+        )
+        db.commit()
+        return db
+
+    def connect(self):
+        return self.db.get()
+
+    def get(self, key):
+        try:
+            with self.lock:
+                row = self.connect().execute(
+                    "SELECT body FROM analyses WHERE key = ? AND expires > ?", (key, time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logs.event(log, "shared_cache_read_failed", logging.WARNING, error=str(e))
+            return None
+        return row[0] if row else None
+
+    def put(self, key, body):
+        try:
+            with self.lock:
+                db = self.connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)",
+                    (key, time.time() + self.ttl, body),
+                )
+                self.puts += 1
+                if self.puts % SHARED_TRIM_EVERY == 0:
+                    db.execute("DELETE FROM analyses WHERE expires <= ?", (time.time(),))
+                    db.execute(
+                        "DELETE FROM analyses WHERE key IN (SELECT key FROM analyses"
+                        " ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    )
+                db.commit()
+        except sqlite3.Error as e:
+            logs.event(log, "shared_cache_write_failed", logging.WARNING, error=str(e))
+
+
+class AnalysisCache:
+    def __init__(self, max_bytes=MAX_BYTES, ttl=TTL, shared=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return orjson.loads(entry[1])
+                self._remove(key)
+
+        if self.shared is not None:
+            body = self.shared.get(key)
+            if body is not None:
+                with self.lock:
+                    self.shared_hits += 1
+                    self._store(key, body)
+                return orjson.loads(body)
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        body = orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+        with self.lock:
+            self._store(key, body)
+        if self.shared is not None:
+            self.shared.put(key, body)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _store(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, body)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, body = self.entries.pop(key)
+        self.bytes -= len(body)
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            "shared": self.shared.path if self.shared is not None else None,
+        }
+
+
+def create():
+    if MAX_BYTES <= 0:
+        return None
+    shared = SharedCache(SHARED_PATH, TTL, SHARED_MAX_ENTRIES) if SHARED_PATH else None
+    return AnalysisCache(shared=shared)
+
+
+cache = create()
@@ -0,0 +1,124 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import boot
+import numpy as np
+
+# Opt-in dynamic batching for single-row model calls. Request threads hand
+# their rows to a per-model collector thread, which waits up to `window_ms`
+# (or until `max_rows` rows are queued), scores everything with one batched
+# predict and hands each caller its own slice of the result.
+#
+#   AIGIS_BATCH_WINDOW_MS=2 AIGIS_BATCH_MAX_ROWS=64   (window 0 disables it)
+
+WINDOW_MS = float(os.environ.get("AIGIS_BATCH_WINDOW_MS", "0"))
+MAX_ROWS = int(os.environ.get("AIGIS_BATCH_MAX_ROWS", "64"))
+# Recent queue waits kept for the latency percentiles.
+RECENT_WAITS = 1024
+
+
+class MicroBatcher:
+    def __init__(self, name, predict, window_ms=WINDOW_MS, max_rows=MAX_ROWS):
+        self.name = name
+        self.predict_fn = predict
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        # The collector thread and its queue, started in each process.
+        self.collector = boot.PerProcess(self._start)
+
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.full_batches = 0
+        self.errors = 0
+        self.sizes = np.zeros(max_rows + 1, dtype=np.int64)
+        self.waits_ms = deque(maxlen=RECENT_WAITS)
+        self.wait_ms_total = 0.0
+
+    def _start(self):
+        rows = queue.Queue()
+        threading.Thread(
+            target=self._run, args=(rows,), name=f"batcher-{self.name}", daemon=True
+        ).start()
+        return rows
+
+    def predict(self, matrix):
+        future = Future()
+        self.collector.get().put((np.asarray(matrix, dtype=np.float64), future, time.perf_counter()))
+        return future.result()
+
+    def _run(self, rows):
+        while True:
+            batch = [rows.get()]
+            n_rows = len(batch[0][0])
+            deadline = batch[0][2] + self.window
+            while n_rows < self.max_rows:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = rows.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+
+            started = time.perf_counter()
+            try:
+                predictions = self.predict_fn(np.concatenate([item[0] for item in batch]))
+            except Exception as e:
+                self.errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for matrix, future, _ in batch:
+                future.set_result(predictions[offset : offset + len(matrix)])
+                offset += len(matrix)
+            self._record(batch, n_rows, started)
+
+    def _record(self, batch, n_rows, started):
+        self.batches += 1
+        self.requests += len(batch)
+        self.rows += n_rows
+        self.full_batches += n_rows >= self.max_rows
+        self.sizes[min(n_rows, self.max_rows)] += 1
+        for _, _, enqueued in batch:
+            wait_ms = (started - enqueued) * 1000.0
+            self.waits_ms.append(wait_ms)
+            self.wait_ms_total += wait_ms
+
+    def metrics(self):
+        waits = np.array(self.waits_ms)
+        p50, p95, p99 = np.percentile(waits, [50, 95, 99]) if len(waits) else (0.0, 0.0, 0.0)
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_rows": self.max_rows,
+            "batches": self.batches,
+            "requests": self.requests,
+            "rows": self.rows,
+            "full_batches": self.full_batches,
+            "errors": self.errors,
+            "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+            "mean_fill": self.rows / (self.batches * self.max_rows) if self.batches else 0.0,
+            "batch_rows": {str(size): int(count) for size, count in enumerate(self.sizes) if count},
+            "queue_wait_ms": {
+                "mean": self.wait_ms_total / self.requests if self.requests else 0.0,
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(waits.max()) if len(waits) else 0.0,
+            },
+        }
+
+
+def create(name, predict):
+    # None unless batching is switched on; callers then predict directly.
+    if WINDOW_MS <= 0:
+        return None
+    return MicroBatcher(name, predict)
@@ -0,0 +1,436 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+# Offline benchmarks for the serving hot paths: each stage of a quality and
+# level analysis on its own at 1 / 100 / 10k rows, then /analyze, /predict
+# and /gen_report end to end through the ASGI app with a stub LLM. Results
+# are written as JSON and compared with a stored baseline; a case whose p50
+# is more than --tolerance slower than the baseline is a regression and
+# makes the run exit non-zero, and so does a missing baseline unless
+# --no-baseline says the run is only for measuring.
+#
+#   python benchmark.py --save-baseline          # on the reference machine
+#   python benchmark.py                          # compare with the baseline
+#   python benchmark.py --quick --only quality. --no-baseline
+
+BASELINE_PATH = "benchmarks/baseline.json"
+RESULTS_PATH = "benchmarks/latest.json"
+BATCH_SIZES = [1, 100, 10_000]
+# Stages faster than this are called repeatedly within one timed sample.
+SAMPLE_MS = 1.0
+MAX_GROUP = 1000
+# p50 differences below this are treated as timer noise, not regressions.
+NOISE_MS = 0.01
+# Exact SHAP costs ~100ms a row, so it is only measured on small batches.
+EXACT_MAX_ROWS = 100
+# The analysis cache is off for every case except these, which measure it.
+CACHED_CASES = {"POST /analyze (repeated input)"}
+CACHE_MB = 64
+
+QUALITY_RANGES = {
+    "ph": (6.0, 9.0),
+    "ec": (100.0, 3000.0),
+    "tds": (50.0, 2000.0),
+    "th": (50.0, 800.0),
+    "ca": (5.0, 300.0),
+    "mg": (5.0, 150.0),
+    "na": (5.0, 500.0),
+    "k": (0.0, 50.0),
+    "cl": (5.0, 800.0),
+    "so4": (5.0, 500.0),
+    "nitrate": (0.0, 100.0),
+    "fluoride": (0.0, 3.0),
+    "uranium": (0.0, 60.0),
+}
+LEVEL_RANGES = {
+    "annualDomesticIndustryDraft": (0.0, 2000.0),
+    "annualIrrigationDraft": (0.0, 20000.0),
+    "annualGroundwaterDraftTotal": (0.0, 22000.0),
+    "annualReplenishableGroundwaterResources": (100.0, 30000.0),
+    "naturalDischargeNonMonsoon": (0.0, 3000.0),
+    "netGroundwaterAvailability": (100.0, 28000.0),
+}
+
+
+def random_samples(n, seed, ranges):
+    rng = np.random.default_rng(seed)
+    return [
+        {key: round(float(rng.uniform(lo, hi)), 3) for key, (lo, hi) in ranges.items()}
+        for _ in range(n)
+    ]
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModels:
+    # Stands in for google.genai's client.models / client.aio.models.
+    TEXT = "# Groundwater report\n\n## Observed levels\n\nStub text.\n\n## Impact\n\nStub text.\n"
+
+    def __init__(self, delay_ms):
+        self.delay = delay_ms / 1000.0
+
+    def generate_content(self, model, contents):
+        time.sleep(self.delay)
+        return StubResponse(self.TEXT)
+
+
+class StubAsyncModels(StubModels):
+    async def generate_content(self, model, contents):
+        await asyncio.sleep(self.delay)
+        return StubResponse(self.TEXT)
+
+    async def generate_content_stream(self, model, contents):
+        async def chunks():
+            for line in self.TEXT.splitlines(keepends=True):
+                await asyncio.sleep(self.delay / 8)
+                yield StubResponse(line)
+
+        return chunks()
+
+
+class StubLLM:
+    def __init__(self, delay_ms=0.0):
+        self.models = StubModels(delay_ms)
+        self.aio = type("aio", (), {"models": StubAsyncModels(delay_ms)})()
+
+
+def summarize(latencies_ms, rows, elapsed):
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "rows": rows,
+        "iterations": len(latencies_ms),
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "min_ms": float(np.min(latencies_ms)),
+        "rows_per_s": rows * len(latencies_ms) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(fn, rows, repeat, warmup, max_seconds):
+    # `fn` gets the iteration number so end-to-end cases can send a new
+    # sample each time instead of measuring a cache. Calls much shorter than
+    # SAMPLE_MS are timed in groups and reported per call, so timer overhead
+    # does not swamp microsecond stages.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        t = time.perf_counter()
+        for i in range(warmup):
+            fn(i)
+        per_call = (time.perf_counter() - t) / max(warmup, 1)
+        number = int(min(max(SAMPLE_MS / 1000.0 / max(per_call, 1e-9), 1), MAX_GROUP))
+
+        latencies = []
+        calls = warmup
+        started = time.perf_counter()
+        while len(latencies) < repeat:
+            t = time.perf_counter()
+            for _ in range(number):
+                fn(calls)
+                calls += 1
+            latencies.append((time.perf_counter() - t) * 1000.0 / number)
+            if time.perf_counter() - started > max_seconds and len(latencies) >= 3:
+                break
+        elapsed = time.perf_counter() - started
+    result = summarize(np.array(latencies), rows * number, elapsed)
+    result["rows"], result["calls_per_sample"] = rows, number
+    return result
+
+
+def stage_cases(batch_sizes):
+    import pred_level
+    import pred_quality
+    import quality_rules
+    import schemas
+
+    largest = max(batch_sizes)
+    quality_records = random_samples(largest, 0, QUALITY_RANGES)
+    level_records = random_samples(largest, 1, LEVEL_RANGES)
+    quality = schemas.QUALITY.parse_many(quality_records)
+    level = schemas.LEVEL.parse_many(level_records)
+
+    cases = []
+    for n in batch_sizes:
+        q, l = quality[:n], level[:n]
+        cases += [
+            (
+                f"quality.parse[{n}]",
+                n,
+                lambda i, n=n: schemas.QUALITY.parse_many(quality_records[:n]),
+            ),
+            (f"quality.inference[{n}]", n, lambda i, q=q: pred_quality.predict_matrix(q)),
+            (f"quality.rules[{n}]", n, lambda i, q=q: quality_rules.evaluate(q)),
+            (
+                f"quality.explain_fast[{n}]",
+                n,
+                lambda i, q=q: pred_quality.explain_matrix(q, "fast"),
+            ),
+            (f"level.parse[{n}]", n, lambda i, n=n: schemas.LEVEL.parse_many(level_records[:n])),
+            (f"level.inference[{n}]", n, lambda i, l=l: pred_level.predict_matrix(l)),
+            (
+                f"level.classify[{n}]",
+                n,
+                lambda i, s=pred_level.predict_matrix(l): pred_level.classify_stages(s),
+            ),
+        ]
+        if n <= EXACT_MAX_ROWS:
+            cases.append(
+                (
+                    f"quality.explain_exact[{n}]",
+                    n,
+                    lambda i, q=q: pred_quality.explain_matrix(q, "exact"),
+                )
+            )
+
+    # The single-sample paths /analyze and /predict go through.
+    def quality_row(i):
+        return quality[i % largest : i % largest + 1]
+
+    def level_row(i):
+        return level[i % largest : i % largest + 1]
+
+    cases += [
+        ("quality.analyze_sample[exact]", 1, lambda i: pred_quality.analyze_sample(quality_row(i))),
+        (
+            "quality.analyze_sample[fast]",
+            1,
+            lambda i: pred_quality.analyze_sample(quality_row(i), explain="fast"),
+        ),
+        (
+            "quality.explain_prediction[exact]",
+            1,
+            lambda i: pred_quality.explain_prediction(quality_row(i)),
+        ),
+        ("level.predict_stage", 1, lambda i: pred_level.predict_stage(level_row(i))),
+    ]
+    return cases
+
+
+def endpoint_cases(client, report_timeout=60.0):
+    quality_samples = random_samples(2000, 2, QUALITY_RANGES)
+    level_samples = random_samples(2000, 3, LEVEL_RANGES)
+
+    def sample(i):
+        return {**quality_samples[i % 2000], **level_samples[i % 2000]}
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{path}: {response.status_code} {response.text[:200]}")
+        return response
+
+    def predict_body(i):
+        future = dict(quality_samples[(i + 1) % 2000])
+        future["groundwaterParameters"] = [
+            {"type": key, "value": value} for key, value in level_samples[(i + 1) % 2000].items()
+        ]
+        return {"existing": sample(i), "for_prediction": future}
+
+    def scenarios_body(i):
+        return {
+            "existing": sample(i),
+            "scenarios": [{"name": f"s{k}", **quality_samples[(i + k) % 2000]} for k in range(5)],
+            "horizon_years": 20,
+        }
+
+    def batch_body(i):
+        return [sample(i * 100 + k) for k in range(100)]
+
+    def report(i):
+        body = {"after_pred": sample(i), "language": "English", "reason": f"benchmark {i}"}
+        job = post("/gen_report", body).json()
+        deadline = time.monotonic() + report_timeout
+        while job["status"] not in ("done", "failed"):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Report job {job['job_id']} did not finish")
+            time.sleep(0.002)
+            job = client.get(f"/gen_report/{job['job_id']}").json()
+        if job["status"] == "failed":
+            raise RuntimeError(f"Report job failed: {job.get('error')}")
+
+    return [
+        ("POST /analyze?explain=exact", 1, lambda i: post("/analyze", sample(i))),
+        ("POST /analyze?explain=fast", 1, lambda i: post("/analyze?explain=fast", sample(i))),
+        ("POST /analyze?explain=none", 1, lambda i: post("/analyze?explain=none", sample(i))),
+        ("POST /analyze (repeated input)", 1, lambda i: post("/analyze", sample(0))),
+        ("POST /predict?explain=fast", 1, lambda i: post("/predict?explain=fast", predict_body(i))),
+        ("POST /predict (5 scenarios x 20y)", 101, lambda i: post("/predict", scenarios_body(i))),
+        ("POST /analyze/batch[100]", 100, lambda i: post("/analyze/batch", batch_body(i))),
+        ("POST /gen_report (stub LLM)", 1, report),
+    ]
+
+
+@contextlib.contextmanager
+def analysis_cache_enabled():
+    import analysis_cache
+
+    previous = analysis_cache.cache
+    analysis_cache.cache = analysis_cache.AnalysisCache(max_bytes=CACHE_MB * 1024 * 1024)
+    try:
+        yield
+    finally:
+        analysis_cache.cache = previous
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            rows.append((name, current["p50_ms"], None, None, "new"))
+            continue
+        ratio = current["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] else float("inf")
+        status = "ok"
+        if ratio > 1 + tolerance and current["p50_ms"] - previous["p50_ms"] > NOISE_MS:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            status = "faster"
+        rows.append((name, current["p50_ms"], previous["p50_ms"], ratio, status))
+    return rows, regressions
+
+
+def print_results(results, comparison):
+    width = max(len(name) for name in results)
+    header = f"{'case':<{width}}  {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'rows/s':>12}"
+    print(header + "  baseline")
+    compared = {row[0]: row for row in comparison}
+    for name, r in results.items():
+        line = f"{name:<{width}}  {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['p99_ms']:>10.3f}"
+        line += f" {r['rows_per_s']:>12.0f}"
+        row = compared.get(name)
+        if row is not None and row[2] is not None:
+            line += f"  {row[2]:.3f} ms  x{row[3]:.2f} {row[4]}"
+        elif row is not None:
+            line += "  (new)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend hot paths")
+    parser.add_argument("--only", help="Run only cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations and no 10k batches")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="Time cap per case")
+    parser.add_argument("--llm-ms", type=float, default=0.0, help="Stub LLM latency per call")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--out", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--no-baseline", action="store_true", help="Measure without comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50 slowdown")
+    args = parser.parse_args()
+    compare_baseline = not (args.save_baseline or args.no_baseline)
+    if compare_baseline and not os.path.exists(args.baseline):
+        raise SystemExit(
+            f"No baseline at {args.baseline}; create one with --save-baseline on the"
+            " reference machine, or pass --no-baseline to only measure"
+        )
+
+    warnings.filterwarnings("ignore")
+    # No warm-up thread competing with the first cases and no sampled request
+    # logs; reports, jobs and the report cache go to a temporary directory.
+    # The analysis cache is disabled so cases measure the work, not lookups.
+    os.environ.setdefault("AIGIS_WARMUP", "off")
+    os.environ.setdefault("AIGIS_LOG_SAMPLE", "0")
+    os.environ["AIGIS_ANALYSIS_CACHE_MB"] = "0"
+    batch_sizes = [1, 100] if args.quick else BATCH_SIZES
+    repeat = min(args.repeat, 10) if args.quick else args.repeat
+
+    import main as app_module
+    import report_cache
+    import report_store
+    from fastapi.testclient import TestClient
+
+    results = {}
+
+    def run(cases):
+        for name, rows, fn in cases:
+            if args.only and args.only not in name:
+                continue
+            cache = analysis_cache_enabled() if name in CACHED_CASES else contextlib.nullcontext()
+            with cache:
+                results[name] = measure(fn, rows, repeat, args.warmup, args.max_seconds)
+            r = results[name]
+            print(f"{name}: p50 {r['p50_ms']:.3f} ms, p99 {r['p99_ms']:.3f} ms", file=sys.stderr)
+
+    run(stage_cases(batch_sizes))
+
+    if not args.skip_endpoints:
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = app_module.report_queue
+            queue.llm_client = StubLLM(args.llm_ms)
+            queue.cache = report_cache.ReportCache(os.path.join(tmp, "cache"))
+            queue.jobs_dir = os.path.join(tmp, "jobs")
+            queue.store = report_store.ReportStore(os.path.join(tmp, "reports"))
+            app_module.report_storage = queue.store
+            with TestClient(app_module.app) as client:
+                run(endpoint_cases(client))
+
+    if not results:
+        raise SystemExit(f"No case matches --only {args.only!r}")
+
+    output = {"environment": environment(), "results": results}
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+
+    comparison, regressions = [], []
+    if compare_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparison, regressions = compare(results, baseline["results"], args.tolerance)
+        print(f"Baseline: {args.baseline} ({baseline['environment'].get('commit')})")
+    print_results(results, comparison)
+    print(f"Results written to {args.out}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(
+            f"{len(regressions)} regression(s) over {args.tolerance:.0%}: {', '.join(regressions)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
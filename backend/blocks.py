@@ -0,0 +1,337 @@
+import csv
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import logs
+import numpy as np
+import pred_level
+import schemas
+
+# In-memory, columnar copy of the groundwater resource dataset (gwr.csv),
+# with the predicted stage and classification of every row computed in one
+# batch when the file is loaded. Rows are sorted by a lowercase
+# "state / district / block" key, so a state, a district or a single block
+# is one contiguous slice found by binary search.
+#
+# AIGIS_GWR_PATH points at the CSV; the file is reloaded in the background
+# when it changes.
+
+DEFAULT_PATHS = ["datasets/gwr.csv", "../frontend/public/datasets/gwr.csv"]
+STAGE_COLUMN = "Stage of Groundwater Development (%)"
+SEP = "\x1f"
+GROUP_BY = ["state", "district"]
+ROLLUP_CACHE_ENTRIES = 256
+# Level columns summed per group in rollups.
+TOTALS = {
+    "total_draft": "Annual Groundwater Draft (Total)",
+    "total_net_availability": "Net Groundwater Availability",
+}
+# Sorts after every real character, closing a prefix range.
+END = "\U0010ffff"
+
+log = logs.get("blocks")
+
+
+def dataset_path():
+    path = os.environ.get("AIGIS_GWR_PATH")
+    if path:
+        return path
+    return next((p for p in DEFAULT_PATHS if os.path.exists(p)), DEFAULT_PATHS[0])
+
+
+def to_float(raw):
+    # Every column read here is non-negative; gwr.csv marks missing values
+    # with -9999.
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return np.nan
+    return value if value >= 0 else np.nan
+
+
+def block_key(*parts):
+    return SEP.join(part.strip().lower() for part in parts)
+
+
+class BlockTable:
+    def __init__(self, state, district, block, values, observed, results=None):
+        keys = np.array([block_key(s, d, b) for s, d, b in zip(state, district, block)])
+        order = np.argsort(keys, kind="stable")
+
+        self.keys = keys[order]
+        self.state = np.array(state, dtype=object)[order]
+        self.district = np.array(district, dtype=object)[order]
+        self.block = np.array(block, dtype=object)[order]
+        self.values = np.ascontiguousarray(values[order])
+        self.observed = observed[order]
+        # Only rows with every model input present are scored; the rest have
+        # no prediction or classification. With a results store only rows
+        # not scored by this model before are run through it; `scoring` says
+        # how many.
+        complete = ~np.isnan(self.values).any(axis=1)
+        self.predicted = np.full(len(keys), np.nan)
+        self.predicted[complete], self.scoring = pred_level.predict_batch_values(
+            self.values[complete], results
+        )
+        self.classes = pred_level.stage_classes(self.predicted)
+        self.classification = pred_level.STAGE_LABELS[self.classes]
+        self.classification[~complete] = None
+        self.rollups = {group_by: self._rollup(group_by) for group_by in GROUP_BY}
+        # Rendered rollup responses. A changed dataset builds a new table and
+        # a new model means a new process, so neither can serve stale entries.
+        self.rollup_cache = OrderedDict()
+        # Handlers run on FastAPI's threadpool, so lookups, inserts and
+        # evictions are serialized; rendering happens outside the lock.
+        self.rollup_lock = threading.Lock()
+
+        # Block and district names on their own, for search across states.
+        names = [(block_key(b), i) for i, b in enumerate(self.block) if b]
+        names += [(block_key(d), i) for i, d in enumerate(self.district)]
+        names.sort()
+        self.names = np.array([name for name, _ in names])
+        self.name_rows = np.array([i for _, i in names], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _rollup(self, group_by):
+        # Rows are sorted by key, so every state or district is a contiguous
+        # run and the aggregates are one reduceat per column.
+        depth = GROUP_BY.index(group_by) + 1
+        group_keys = np.array([SEP.join(k.split(SEP)[:depth]) for k in self.keys])
+        starts = np.flatnonzero(np.r_[True, group_keys[1:] != group_keys[:-1]])
+
+        predicted_ok = ~np.isnan(self.predicted)
+        one_hot = np.zeros((len(self), len(pred_level.STAGE_LABELS)), dtype=np.int64)
+        one_hot[predicted_ok, self.classes[predicted_ok]] = 1
+        observed_ok = ~np.isnan(self.observed)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_predicted = np.add.reduceat(np.where(predicted_ok, self.predicted, 0.0), starts) / (
+                np.add.reduceat(predicted_ok.astype(np.int64), starts)
+            )
+            mean_observed = np.add.reduceat(np.where(observed_ok, self.observed, 0.0), starts) / (
+                np.add.reduceat(observed_ok.astype(np.int64), starts)
+            )
+        columns = [schemas.LEVEL.columns.index(column) for column in TOTALS.values()]
+        totals = np.add.reduceat(np.nan_to_num(self.values[:, columns]), starts)
+
+        return {
+            "state": self.state[starts],
+            "district": self.district[starts] if depth > 1 else None,
+            "keys": group_keys[starts],
+            "rows": np.diff(np.r_[starts, len(self)]),
+            "counts": np.add.reduceat(one_hot, starts),
+            "mean_predicted_stage": mean_predicted,
+            "mean_observed_stage": mean_observed,
+            "totals": totals,
+        }
+
+    def rollup(self, group_by="state", state=None, classification=None):
+        rollup = self.rollups[group_by]
+        selected = np.ones(len(rollup["keys"]), dtype=bool)
+        if state:
+            prefix = block_key(state)
+            keys = rollup["keys"]
+            selected &= (keys == prefix) | np.char.startswith(keys, prefix + SEP)
+        if classification:
+            column = list(pred_level.STAGE_LABELS).index(classification)
+            selected &= rollup["counts"][:, column] > 0
+
+        groups = []
+        for i in np.flatnonzero(selected):
+            group = {"state": rollup["state"][i]}
+            if rollup["district"] is not None:
+                group["district"] = rollup["district"][i]
+            group["rows"] = int(rollup["rows"][i])
+            group["classification"] = dict(
+                zip(pred_level.STAGE_LABELS, rollup["counts"][i].tolist())
+            )
+            group["mean_predicted_stage"] = _scalar(rollup["mean_predicted_stage"][i])
+            group["mean_observed_stage"] = _scalar(rollup["mean_observed_stage"][i])
+            for name, total in zip(TOTALS, rollup["totals"][i].tolist()):
+                group[name] = total
+            groups.append(group)
+        return groups
+
+    def cached_rollup(self, render, **params):
+        key = tuple(sorted(params.items()))
+        with self.rollup_lock:
+            body = self.rollup_cache.get(key)
+            if body is not None:
+                self.rollup_cache.move_to_end(key)
+                return body
+
+        body = render(self.rollup(**params))
+        with self.rollup_lock:
+            self.rollup_cache[key] = body
+            self.rollup_cache.move_to_end(key)
+            while len(self.rollup_cache) > ROLLUP_CACHE_ENTRIES:
+                self.rollup_cache.popitem(last=False)
+        return body
+
+    def prefix_range(self, *parts):
+        prefix = block_key(*parts)
+        if len(parts) < 3:
+            prefix += SEP
+        lo = int(np.searchsorted(self.keys, prefix, side="left"))
+        hi = int(np.searchsorted(self.keys, prefix + END, side="left"))
+        return lo, hi
+
+    def exact_range(self, state, district, block):
+        key = block_key(state, district, block)
+        lo = int(np.searchsorted(self.keys, key, side="left"))
+        hi = int(np.searchsorted(self.keys, key, side="right"))
+        return lo, hi
+
+    def columns(self, lo, hi):
+        columns = {
+            "state": self.state[lo:hi].tolist(),
+            "district": self.district[lo:hi].tolist(),
+            "block": self.block[lo:hi].tolist(),
+        }
+        for j, name in enumerate(schemas.LEVEL.columns):
+            columns[name] = np.ascontiguousarray(self.values[lo:hi, j])
+        columns["observed_stage"] = self.observed[lo:hi]
+        columns["predicted_stage"] = self.predicted[lo:hi]
+        columns["classification"] = self.classification[lo:hi].tolist()
+        return columns
+
+    def records(self, lo, hi):
+        columns = self.columns(lo, hi)
+        return [
+            {name: _scalar(column[i]) for name, column in columns.items()}
+            for i in range(hi - lo)
+        ]
+
+    def states(self):
+        summary = {}
+        for state, district in zip(self.state, self.district):
+            entry = summary.setdefault(state, {"state": state, "districts": set(), "rows": 0})
+            entry["districts"].add(district)
+            entry["rows"] += 1
+        return [
+            {"state": s["state"], "districts": len(s["districts"]), "rows": s["rows"]}
+            for s in summary.values()
+        ]
+
+    def search(self, query, limit=20):
+        # Blocks or districts whose name starts with `query`, one entry per
+        # (state, district, block).
+        prefix = block_key(query)
+        lo = int(np.searchsorted(self.names, prefix, side="left"))
+        hi = int(np.searchsorted(self.names, prefix + END, side="left"))
+        seen = {}
+        for i in self.name_rows[lo:hi]:
+            location = (self.state[i], self.district[i], self.block[i])
+            if location not in seen:
+                if len(seen) >= limit:
+                    break
+                seen[location] = {
+                    "state": location[0],
+                    "district": location[1],
+                    "block": location[2],
+                    "predicted_stage": _scalar(self.predicted[i]),
+                    "classification": self.classification[i],
+                }
+        return list(seen.values())
+
+
+def _scalar(value):
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    return value
+
+
+def read_table(path, results=None):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [h.strip() for h in next(reader)]
+        lookup = {h.lower(): j for j, h in enumerate(header)}
+        try:
+            state_j = lookup["state"]
+            district_j = lookup["district name"]
+            block_j = lookup["block"]
+            value_js = [lookup[c.lower()] for c in schemas.LEVEL.columns]
+        except KeyError as e:
+            raise ValueError(f"{path} is missing column {e}")
+        stage_j = lookup.get(STAGE_COLUMN.lower())
+
+        state, district, block, values, observed = [], [], [], [], []
+        for row in reader:
+            if not row:
+                continue
+            state.append(row[state_j].strip())
+            district.append(row[district_j].strip())
+            block.append(row[block_j].strip())
+            values.append([to_float(row[j]) for j in value_js])
+            observed.append(to_float(row[stage_j]) if stage_j is not None else np.nan)
+
+    return BlockTable(
+        state,
+        district,
+        block,
+        np.array(values, dtype=np.float64).reshape(-1, len(value_js)),
+        np.array(observed, dtype=np.float64),
+        results,
+    )
+
+
+class BlockStore:
+    def __init__(self, path=None, results=None):
+        self.path = path or dataset_path()
+        self.results = results
+        self.table = None
+        self.loaded_at = None
+        self.signature = None
+        self.lock = threading.Lock()
+        self.reloader = None
+
+    def current(self):
+        # Returns the loaded table. The first load happens in the caller;
+        # after that a changed file is read and scored on a background
+        # thread while the old table keeps being served. None when the
+        # dataset is missing or could not be read.
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self.table
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self.signature:
+            return self.table
+        if self.table is None:
+            with self.lock:
+                if self.table is None and signature != self.signature:
+                    self._load(signature)
+            return self.table
+        with self.lock:
+            if signature != self.signature and not (self.reloader and self.reloader.is_alive()):
+                self.reloader = threading.Thread(
+                    target=self._load, args=(signature,), name="blocks-reload", daemon=True
+                )
+                self.reloader.start()
+        return self.table
+
+    def _load(self, signature):
+        try:
+            table = read_table(self.path, self.results)
+        except (OSError, ValueError) as e:
+            # Not retried until the file changes again; any old table stays.
+            self.signature = signature
+            logs.event(log, "blocks_load_failed", logging.WARNING, path=self.path, error=str(e))
+            return
+        self.table, self.signature = table, signature
+        self.loaded_at = time.time()
+        logs.event(log, "blocks_loaded", rows=len(table), path=self.path, scoring=table.scoring)
+
+    def status(self):
+        return {
+            "path": self.path,
+            "loaded": self.table is not None,
+            "loaded_at": self.loaded_at,
+            "reloading": bool(self.reloader and self.reloader.is_alive()),
+            "rows": len(self.table) if self.table is not None else 0,
+            "scoring": self.table.scoring if self.table is not None else None,
+        }
@@ -0,0 +1,113 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Cold-start bookkeeping: modules record how long their import-time work
+# takes (model loads, explainer builds, warm-up) into `stages`, and report()
+# summarises it together with the process' peak RSS.
+#
+#   python boot.py                  # import the app once and print the report as JSON
+#   python boot.py memory <pid>...  # unique vs shared memory of each process and its children
+
+started = time.perf_counter()
+stages = {}
+# Set once the models were loaded in the gunicorn master before forking.
+preloaded = False
+
+SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "unique",
+    "Private_Dirty": "unique",
+    "Swap": "swap",
+}
+
+
+class PerProcess:
+    # A value built lazily once in each process. Threads and connections made
+    # in the gunicorn master do not survive the fork into the workers, so
+    # whatever holds one is rebuilt the first time a new pid asks for it.
+
+    def __init__(self, create):
+        self.create = create
+        self.value = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.value = self.create()
+                    self.pid = os.getpid()
+        return self.value
+
+
+def memory(pid="self"):
+    # Pages still shared with the master after fork show up as Shared_*;
+    # whatever a worker has written to (or allocated itself) is Private_*.
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    usage = {"pid": os.getpid() if pid == "self" else int(pid)}
+    usage.update({name: 0 for name in SMAPS_FIELDS.values()})
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in SMAPS_FIELDS:
+            usage[SMAPS_FIELDS[key]] += int(value.split()[0]) * 1024
+    return usage
+
+
+def process_tree(pid):
+    pids = [int(pid)]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+    for child in children:
+        pids.extend(process_tree(child))
+    return pids
+
+
+def report():
+    return {
+        "stages_ms": {stage: round(ms, 3) for stage, ms in stages.items()},
+        "since_start_ms": round((time.perf_counter() - started) * 1000.0, 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "preloaded": preloaded,
+    }
+
+
+def print_memory(pids):
+    print(f"{'pid':>8} {'rss MB':>9} {'pss MB':>9} {'unique MB':>10} {'shared MB':>10}")
+    for pid in pids:
+        usage = memory(pid)
+        if usage is None:
+            continue
+        print(
+            f"{pid:>8} {usage['rss'] / 2**20:>9.1f} {usage['pss'] / 2**20:>9.1f} "
+            f"{usage['unique'] / 2**20:>10.1f} {usage['shared'] / 2**20:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["memory"]:
+        print_memory([pid for arg in sys.argv[2:] for pid in process_tree(arg)])
+        raise SystemExit
+
+    import boot
+    from timing import timed
+
+    with timed(boot.stages, "import main"):
+        import main  # noqa: F401
+
+    print(json.dumps(boot.report(), indent=2))
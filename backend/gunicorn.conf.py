@@ -0,0 +1,38 @@
+import os
+import shutil
+
+# gunicorn -c gunicorn.conf.py main:app
+#
+# AIGIS_PRELOAD=1 (default) imports the app and loads both models once in
+# the master; workers are forked afterwards and share those pages
+# copy-on-write instead of each loading their own copy.
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get("AIGIS_PRELOAD", "1") == "1"
+
+# Workers write their /metrics samples here so that any worker can report
+# for all of them. It has to be set before prometheus_client is imported.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/aigis-metrics")
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Samples left over from a previous run would otherwise be added in.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import main
+
+    main.preload_models()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,108 @@
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+import boot
+import orjson
+
+# Structured logging kept off the request path. Records go onto a bounded
+# queue and a background thread formats them as one JSON object per line;
+# when the queue is full records are dropped and counted rather than making
+# a request wait. Per-request events are sampled with `sampled()`, warnings
+# and errors are always logged.
+#
+#   AIGIS_LOG_LEVEL=INFO AIGIS_LOG_SAMPLE=0.01 AIGIS_LOG_QUEUE=10000
+
+LEVEL = os.environ.get("AIGIS_LOG_LEVEL", "INFO").upper()
+SAMPLE = float(os.environ.get("AIGIS_LOG_SAMPLE", "0.01"))
+QUEUE_SIZE = int(os.environ.get("AIGIS_LOG_QUEUE", "10000"))
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            "pid": record.process,
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+
+
+class AsyncHandler(logging.Handler):
+    def __init__(self, target, maxsize=QUEUE_SIZE):
+        super().__init__()
+        self.target = target
+        self.maxsize = maxsize
+        # The writer thread and its queue, started in each process.
+        self.writer = boot.PerProcess(self._start)
+        self.dropped = 0
+
+    def _start(self):
+        records = queue.Queue(self.maxsize)
+        threading.Thread(target=self._run, args=(records,), name="log-writer", daemon=True).start()
+        return records
+
+    def emit(self, record):
+        try:
+            self.writer.get().put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self, records):
+        while True:
+            record = records.get()
+            try:
+                self.target.handle(record)
+            except Exception:
+                self.handleError(record)
+
+    def flush(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        records = self.writer.value
+        while records is not None and not records.empty() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.target.flush()
+
+
+handler = None
+
+
+def setup():
+    global handler
+    if handler is not None:
+        return handler
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter())
+    handler = AsyncHandler(stream)
+    logger = logging.getLogger("aigis")
+    logger.addHandler(handler)
+    logger.setLevel(LEVEL)
+    logger.propagate = False
+    return handler
+
+
+def get(name):
+    return logging.getLogger(f"aigis.{name}")
+
+
+def event(logger, name, level=logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, name, extra={"fields": fields})
+
+
+def sampled(logger, name, **fields):
+    # For events logged on every request; `fields` should be small summary
+    # values, never whole payloads.
+    if SAMPLE > 0 and random.random() < SAMPLE:
+        event(logger, name, sampled=SAMPLE, **fields)
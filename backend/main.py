@@ -1,23 +1,131 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+import analysis_cache
+import blocks
+import boot
+import logs
+import metrics
 import pred_level
 import pred_quality
 import json
-import ai_report
+import profiler
+import report_cache
+import report_jobs
+import report_store
+import results_store
+import scenarios
+import schemas
+from responses import NativeJSONResponse, analysis_response, dumps
+from timing import timed
+import asyncio
+import gc
+import io
+import logging
 import os
-import shutil
 from contextlib import asynccontextmanager
+from typing import Literal
+
+# exact: SHAP values; fast: Saabas contributions from the compiled trees;
+# none: skip the explanation.
+ExplainMode = Literal["exact", "fast", "none"]
+
+logs.setup()
+log = logs.get("main")
+
+block_store = blocks.BlockStore(results=results_store.ResultStore())
+
+report_storage = report_store.ReportStore(
+    max_bytes=int(float(os.environ.get("REPORT_STORE_MAX_MB", "512")) * 1024 * 1024),
+    max_age=float(os.environ.get("REPORT_STORE_MAX_AGE_HOURS", "168")) * 3600,
+)
+
+report_queue = report_jobs.ReportJobs(
+    max_workers=int(os.environ.get("REPORT_WORKERS", "2")),
+    max_pending=int(os.environ.get("REPORT_MAX_PENDING", "16")),
+    max_age=float(os.environ.get("REPORT_JOBS_MAX_AGE_HOURS", "24")) * 3600,
+    max_files=int(os.environ.get("REPORT_JOBS_MAX_FILES", "10000")),
+    cache=report_cache.ReportCache(
+        max_entries=int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", "256")),
+        max_age=float(os.environ.get("REPORT_CACHE_MAX_AGE_HOURS", "168")) * 3600,
+    ),
+    store=report_storage,
+)
+
+
+def load_blocks():
+    with timed(boot.stages, "load_blocks"):
+        block_store.current()
+
+
+def warm_up_models():
+    with timed(boot.stages, "warm_up"):
+        pred_quality.warm_up()
+        pred_level.warm_up()
+    load_blocks()
+    logs.event(log, "models_warmed_up", **boot.report())
+
+
+def preload_models():
+    # Called in the gunicorn master (see gunicorn.conf.py) before workers are
+    # forked. Freezing the heap afterwards keeps the collector from writing
+    # to, and so un-sharing, the pages holding the preloaded models.
+    with timed(boot.stages, "preload"):
+        pred_quality.preload()
+        pred_level.preload()
+        load_blocks()
+    boot.preloaded = True
+    gc.freeze()
+    logs.event(log, "models_preloaded", **boot.report())
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    dir_path = "static"
-    shutil.rmtree(dir_path, ignore_errors=True)
-    os.makedirs(dir_path, exist_ok=True)
-    print(f"Reset directory: {dir_path}")
+    # Rendered reports in static/ are kept across restarts so the report
+    # cache stays valid; the storage retention policy bounds how much survives.
+    report_queue.cache.evict()
+    eviction = asyncio.create_task(
+        report_store.run_eviction(
+            report_storage.evict,
+            float(os.environ.get("REPORT_STORE_EVICT_INTERVAL", "300")),
+            "report",
+        )
+    )
+
+    # jobs/ is shared by every worker, so a restarting worker must not clear
+    # it; old and orphaned job files are expired instead.
+    os.makedirs(report_queue.jobs_dir, exist_ok=True)
+    job_eviction = asyncio.create_task(
+        report_store.run_eviction(
+            report_queue.evict,
+            float(os.environ.get("REPORT_JOBS_EVICT_INTERVAL", "300")),
+            "job",
+        )
+    )
+
+    # AIGIS_WARMUP=background (default) serves requests while the models warm
+    # up on a thread; "sync" blocks startup until they are ready, "off" skips it.
+    # Workers forked from a preloading master start out warm.
+    warmup_mode = "off" if boot.preloaded else os.environ.get("AIGIS_WARMUP", "background")
+    warmup = None
+    if warmup_mode == "sync":
+        warm_up_models()
+    elif warmup_mode != "off":
+        warmup = asyncio.create_task(asyncio.to_thread(warm_up_models))
+
+    report_queue.start()
 
     yield
 
+    if warmup is not None:
+        warmup.cancel()
+    eviction.cancel()
+    job_eviction.cancel()
+    await report_queue.stop()
+    pred_quality.shutdown_explain_pool()
+
 app = FastAPI(lifespan=lifespan)
 
 origins = [
@@ -35,7 +143,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Outermost, so the request histogram covers CORS handling and serialization.
+app.add_middleware(metrics.RequestMetrics, profiler=profiler.create())
+
+app.mount("/static", StaticFiles(directory=report_storage.directory), name="static")
+
+def read_batch_upload(raw, filename, content_type):
+    filename = (filename or "").lower()
+    content_type = content_type or ""
+    import pandas as pd
+
+    if filename.endswith(".parquet") or "parquet" in content_type:
+        return pd.read_parquet(io.BytesIO(raw))
+    return pd.read_csv(io.BytesIO(raw))
+
+
+def analyze_batch_matrices(quality_matrix, level_matrix, explain="none", sort=False):
+    quality_results = pred_quality.predict_batch(quality_matrix)
+    level_results = pred_level.predict_batch(level_matrix)
+
+    results = [
+        {"quality_analysis": quality, "level_analysis": level}
+        for quality, level in zip(quality_results, level_results)
+    ]
+    body = {"count": len(results), "results": results}
+    if explain == "none":
+        return body
+
+    contributions = pred_quality.explain_matrix(quality_matrix, mode=explain)
+    if sort:
+        for result, row in zip(results, pred_quality.sorted_contributions(contributions)):
+            result["quality_analysis"]["contributions"] = row
+    else:
+        # One N x features array; far smaller and cheaper than a dict per row.
+        body["features"] = pred_quality.features
+        body["contributions"] = contributions
+    return body
+
+
+def sweep_spec(spec):
+    if not spec:
+        return None
+    if not isinstance(spec, dict):
+        raise schemas.InvalidInput("Sweep parameters must be an object")
+    return {schemas.QUALITY.column(key): axis for key, axis in spec.items()}
+
+
+@app.exception_handler(schemas.InvalidInput)
+async def invalid_input_handler(request: Request, exc: schemas.InvalidInput):
+    return JSONResponse({"detail": str(exc)}, status_code=422)
 
 
 @app.get("/")
@@ -44,136 +200,264 @@ def read_root():
 
 
 @app.post("/analyze")
-def analyze_data(data: dict):
-    quality_input = {
-        "pH": float(data.get("ph", 0.0) or 0.0),
-        "EC": float(data.get("ec", 0) or 0),
-        "TDS": float(data.get("tds", 0) or 0),
-        "TH": float(data.get("th", 0) or 0),
-        "Ca": float(data.get("ca", 0) or 0),
-        "Mg": float(data.get("mg", 0) or 0),
-        "Na": float(data.get("na", 0) or 0),
-        "K": float(data.get("k", 0) or 0),
-        "Cl": float(data.get("cl", 0) or 0),
-        "SO4": float(data.get("so4", 0) or 0),
-        "NO3": float(data.get("nitrate", 0) or 0),
-        "F": float(data.get("fluoride", 0.0) or 0.0),
-        "U(ppb)": float(data.get("uranium", 0) or 0),
-    }
+def analyze_data(data: dict, legacy: bool = False, explain: ExplainMode = "exact"):
+    with metrics.stage("parse"):
+        quality_input = schemas.QUALITY.parse(data)
+        level_input = schemas.LEVEL.parse(data)
 
-    quality_analysis = pred_quality.predict(quality_input)
+    quality_analysis = pred_quality.predict(quality_input, explain=explain)
+    level_analysis = pred_level.predict(level_input)
 
-    level_input = [
-        float(data.get("annualDomesticIndustryDraft", 0.0) or 0.0),
-        float(data.get("annualIrrigationDraft", 0.0) or 0.0),
-        float(data.get("annualGroundwaterDraftTotal", 0.0) or 0.0),
-        float(data.get("annualReplenishableGroundwaterResources", 0.0) or 0.0),
-        float(data.get("naturalDischargeNonMonsoon", 0.0) or 0.0),
-        float(data.get("netGroundwaterAvailability", 0.0) or 0.0),
-    ]
+    logs.sampled(
+        log,
+        "analysis",
+        potability_score=quality_analysis["potability_score"],
+        safety_label=quality_analysis["safety_label"],
+        predicted_stage=level_analysis["predicted_stage"],
+        classification=level_analysis["classification"],
+    )
+    return analysis_response(quality_analysis, level_analysis, legacy)
+
+
+@app.post("/predict")
+def predict_data(data: dict, legacy: bool = False, explain: ExplainMode = "exact"):
+    existing = data.get("existing") or {}
 
+    if "scenarios" in data:
+        # {"existing": {...}, "scenarios": [{"name": ..., <for_prediction fields>}, ...],
+        #  "horizon_years": 20}
+        return NativeJSONResponse(
+            scenarios.project(existing, data["scenarios"], data.get("horizon_years"))
+        )
+
+    with metrics.stage("parse"):
+        quality_existing = schemas.QUALITY.parse(existing)
+        level_existing = schemas.LEVEL.parse(existing)
+
+        for_prediction = data.get("for_prediction") or {}
+
+        quality_input, level_for_prediction = scenarios.scenario_inputs(
+            quality_existing, for_prediction
+        )
+        level_input = level_existing + level_for_prediction
+
+    quality_analysis = pred_quality.predict(quality_input, explain=explain)
     level_analysis = pred_level.predict(level_input)
 
-    retJSON = {"quality_analysis": quality_analysis, "level_analysis": level_analysis}
-    print("Analysis result:", retJSON)
-    return json.dumps(retJSON)
+    logs.sampled(
+        log,
+        "analysis",
+        potability_score=quality_analysis["potability_score"],
+        safety_label=quality_analysis["safety_label"],
+        predicted_stage=level_analysis["predicted_stage"],
+        classification=level_analysis["classification"],
+    )
+    return analysis_response(quality_analysis, level_analysis, legacy)
 
 
-@app.post("/predict")
-def predict_data(data: dict):
-    existing = data.get("existing", {})
-
-    quality_existing = {
-        "pH": float(existing.get("ph", 0.0) or 0.0),
-        "EC": float(existing.get("ec", 0) or 0),
-        "TDS": float(existing.get("tds", 0) or 0),
-        "TH": float(existing.get("th", 0) or 0),
-        "Ca": float(existing.get("ca", 0) or 0),
-        "Mg": float(existing.get("mg", 0) or 0),
-        "Na": float(existing.get("na", 0) or 0),
-        "K": float(existing.get("k", 0) or 0),
-        "Cl": float(existing.get("cl", 0) or 0),
-        "SO4": float(existing.get("so4", 0) or 0),
-        "NO3": float(existing.get("nitrate", 0) or 0),
-        "F": float(existing.get("fluoride", 0.0) or 0.0),
-        "U(ppb)": float(existing.get("uranium", 0) or 0),
-    }
+@app.post("/what_if")
+def what_if_sweep(data: dict):
+    # {"sample": {...}, "grid": {"nitrate": {"start": 0, "stop": 200, "steps": 200}}}
+    # or {"sample": {...}, "random": {"ph": {"sd": 0.3}}, "samples": 1000, "seed": 0}
+    sample = schemas.QUALITY.parse(data.get("sample") or {})
+    grid = sweep_spec(data.get("grid"))
+    random = sweep_spec(data.get("random"))
+    try:
+        result = pred_quality.sweep(
+            sample, grid, random, samples=data.get("samples", 1000), seed=data.get("seed")
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise schemas.InvalidInput(f"Invalid sweep: {e}")
 
-    level_existing = [
-        float(existing.get("annualDomesticIndustryDraft", 0.0) or 0.0),
-        float(existing.get("annualIrrigationDraft", 0.0) or 0.0),
-        float(existing.get("annualGroundwaterDraftTotal", 0.0) or 0.0),
-        float(existing.get("annualReplenishableGroundwaterResources", 0.0) or 0.0),
-        float(existing.get("naturalDischargeNonMonsoon", 0.0) or 0.0),
-        float(existing.get("netGroundwaterAvailability", 0.0) or 0.0),
-    ]
+    return NativeJSONResponse(result)
+
+
+@app.post("/gen_report", status_code=202)
+async def generate_report(data: dict):
+    try:
+        job_id = report_queue.submit(data)
+    except report_jobs.QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return report_queue.status(job_id)
+
+
+@app.post("/gen_report/stream")
+async def stream_report(data: dict):
+    async def events():
+        try:
+            async for event, payload in report_queue.stream(data):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            logs.event(log, "report_stream_failed", logging.ERROR, error=str(e))
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def block_table():
+    table = block_store.current()
+    if table is None:
+        raise HTTPException(status_code=503, detail="Block dataset not available")
+    return table
+
+
+@app.get("/blocks")
+def list_blocks(state: str = None, district: str = None):
+    # Columnar rows for a state, a district or (no filter) every block.
+    table = block_table()
+    if district and not state:
+        raise HTTPException(status_code=400, detail="district requires state")
+    if state:
+        lo, hi = table.prefix_range(*[p for p in (state, district) if p])
+    else:
+        lo, hi = 0, len(table)
+    return NativeJSONResponse({"count": hi - lo, **table.columns(lo, hi)})
+
+
+@app.get("/blocks/status")
+def block_status():
+    return block_store.status()
+
+
+@app.get("/blocks/states")
+def list_block_states():
+    return NativeJSONResponse(block_table().states())
+
+
+@app.get("/blocks/search")
+def search_blocks(q: str, limit: int = 20):
+    return NativeJSONResponse(block_table().search(q, max(1, min(limit, 200))))
+
+
+@app.get("/blocks/rollup")
+def rollup_blocks(
+    group_by: Literal["state", "district"] = "state",
+    state: str = None,
+    classification: Literal["Safe", "Semi-Critical", "Critical", "Over-Exploited"] = None,
+):
+    # Per state or district: block counts per stage classification, mean
+    # predicted and observed stage, and total draft / net availability.
+    body = block_table().cached_rollup(
+        dumps, group_by=group_by, state=state, classification=classification
+    )
+    return Response(body, media_type="application/json")
 
-    for_prediction = data.get("for_prediction", {})
-
-    quality_for_prediction = {
-        "pH": float(for_prediction.get("ph", 0.0) or 0.0),
-        "EC": int(for_prediction.get("ec", 0) or 0),
-        "TDS": int(for_prediction.get("tds", 0) or 0),
-        "TH": int(for_prediction.get("th", 0) or 0),
-        "Ca": int(for_prediction.get("ca", 0) or 0),
-        "Mg": int(for_prediction.get("mg", 0) or 0),
-        "Na": int(for_prediction.get("na", 0) or 0),
-        "K": int(for_prediction.get("k", 0) or 0),
-        "Cl": int(for_prediction.get("cl", 0) or 0),
-        "SO4": int(for_prediction.get("so4", 0) or 0),
-        "NO3": int(for_prediction.get("nitrate", 0) or 0),
-        "F": float(for_prediction.get("fluoride", 0.0) or 0.0),
-        "U(ppb)": int(for_prediction.get("uranium", 0) or 0),
-    }
 
-    level_for_prediction_parameters = for_prediction.get("groundwaterParameters", {})
+@app.get("/blocks/{state}/{district}/{block}")
+def get_block(state: str, district: str, block: str):
+    table = block_table()
+    lo, hi = table.exact_range(state, district, block)
+    if lo == hi:
+        raise HTTPException(status_code=404, detail="Block not found")
+    return NativeJSONResponse(table.records(lo, hi))
 
-    level_for_prediction_parameters = {
-        i["type"]: i["value"] for i in level_for_prediction_parameters
+
+@app.get("/reports/storage")
+def report_storage_usage():
+    return report_storage.usage()
+
+
+@app.get("/debug/boot")
+def boot_report():
+    return boot.report()
+
+
+@app.get("/debug/batching")
+def batching_report():
+    return {
+        name: module.row_batcher.metrics() if module.row_batcher is not None else None
+        for name, module in (("quality", pred_quality), ("level", pred_level))
     }
 
-    level_for_prediction = [
-        float(
-            level_for_prediction_parameters.get("annualDomesticIndustryDraft", 0.0)
-            or 0.0
-        ),
-        float(level_for_prediction_parameters.get("annualIrrigationDraft", 0.0) or 0.0),
-        float(
-            level_for_prediction_parameters.get("annualGroundwaterDraftTotal", 0.0)
-            or 0.0
-        ),
-        float(
-            level_for_prediction_parameters.get(
-                "annualReplenishableGroundwaterResources", 0.0
-            )
-            or 0.0
-        ),
-        float(
-            level_for_prediction_parameters.get("naturalDischargeNonMonsoon", 0.0)
-            or 0.0
-        ),
-        float(
-            level_for_prediction_parameters.get("netGroundwaterAvailability", 0.0)
-            or 0.0
-        ),
-    ]
 
-    quality_input = quality_existing
+@app.get("/metrics")
+def metrics_report():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-    level_input = [
-        level_existing[i] + level_for_prediction[i] for i in range(len(level_existing))
-    ]
 
-    quality_analysis = pred_quality.predict(quality_input)
-    level_analysis = pred_level.predict(level_input)
+@app.get("/debug/cache")
+def cache_report():
+    return analysis_cache.cache.stats() if analysis_cache.cache is not None else None
+
 
-    retJSON = {"quality_analysis": quality_analysis, "level_analysis": level_analysis}
-    print("Analysis result:", json.dumps(retJSON, indent=2))
-    return json.dumps(retJSON)
+@app.get("/debug/memory")
+def memory_report():
+    # Reports the worker that served the request; `python boot.py memory
+    # <master pid>` covers the master and every worker at once.
+    return boot.memory()
+
+
+@app.get("/gen_report/{job_id}")
+def report_status(job_id: str):
+    job = report_queue.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown report job")
+
+    return job
+
+
+@app.get("/gen_report/{job_id}/result")
+def report_result(job_id: str):
+    job = report_queue.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown report job")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job.get("error", "Report failed"))
+    if job["status"] != "done":
+        return JSONResponse(job, status_code=202)
+
+    if not os.path.exists(job["url"]):
+        raise HTTPException(status_code=410, detail="Report has expired")
+    return FileResponse(job["url"], filename=os.path.basename(job["url"]))
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request, explain: ExplainMode = "none", sort: bool = False):
+    content_type = request.headers.get("content-type", "")
+
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing 'file' upload")
+            samples = read_batch_upload(
+                await upload.read(), upload.filename, upload.content_type
+            )
+            quality_matrix = schemas.QUALITY.parse_frame(samples)
+            level_matrix = schemas.LEVEL.parse_frame(samples)
+        elif "csv" in content_type or "parquet" in content_type:
+            samples = read_batch_upload(await request.body(), None, content_type)
+            quality_matrix = schemas.QUALITY.parse_frame(samples)
+            level_matrix = schemas.LEVEL.parse_frame(samples)
+        else:
+            records = await request.json()
+            if isinstance(records, dict):
+                records = records.get("samples")
+            if not isinstance(records, list):
+                raise HTTPException(
+                    status_code=400, detail="Expected a JSON array of samples"
+                )
+            quality_matrix = schemas.QUALITY.parse_many(records)
+            level_matrix = schemas.LEVEL.parse_many(records)
+    except (HTTPException, schemas.InvalidInput):
+        raise
+    except (ValueError, ImportError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read samples: {e}")
 
+    if explain == "exact" and len(quality_matrix) > pred_quality.EXPLAIN_MAX_EXACT_ROWS:
+        raise schemas.InvalidInput(
+            f"{len(quality_matrix)} samples with explain=exact; the limit is "
+            f"{pred_quality.EXPLAIN_MAX_EXACT_ROWS} (use explain=fast for larger batches)"
+        )
 
-@app.post("/gen_report")
-def generate_report(data: dict):
-    pdf_url = ai_report.generate(data)
+    body = await run_in_threadpool(
+        analyze_batch_matrices, quality_matrix, level_matrix, explain, sort
+    )
 
-    return pdf_url
+    return NativeJSONResponse(body)
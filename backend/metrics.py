@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+import prometheus_client
+from prometheus_client import CollectorRegistry, Histogram, multiprocess
+
+# Latency histograms served in Prometheus text format at /metrics. Under
+# gunicorn each worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+# (gunicorn.conf.py sets and clears it), so a scrape that lands on any one
+# worker reports the whole server.
+
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+stage_seconds = Histogram(
+    "aigis_stage_seconds",
+    "Time spent in one stage of serving a request",
+    ["stage"],
+    buckets=BUCKETS,
+)
+request_seconds = Histogram(
+    "aigis_request_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=BUCKETS,
+)
+
+
+def observe(stage, ms):
+    stage_seconds.labels(stage).observe(ms / 1000.0)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.labels(name).observe(time.perf_counter() - start)
+
+
+def render():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry)
+    return prometheus_client.generate_latest()
+
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+
+
+class RequestMetrics:
+    # ASGI middleware timing every HTTP request by route template (so
+    # /blocks/{state}/{district}/{block} is one series, not one per block)
+    # and, when a request is sampled, recording a profile of it.
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        profile = self.profiler.maybe_start() if self.profiler is not None else None
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            request_seconds.labels(scope["method"], path, str(status[0])).observe(elapsed)
+            if profile is not None:
+                # Joins the sampler thread and writes a file; kept off the
+                # event loop so other requests on this worker are not stalled.
+                await asyncio.to_thread(profile.finish, f"{scope['method']} {path}", elapsed)
@@ -1,7 +1,46 @@
-import joblib
-import json
+import threading
+import numpy as np
+import analysis_cache
+import batcher
+import boot
+import metrics
+import tree_engine
+from timing import timed
 
-model = joblib.load("models/gw_level.pkl")
+MODEL_PATH = "models/gw_level.pkl"
+
+with timed(boot.stages, "pred_level.load_compiled"):
+    compiled = tree_engine.load_for("models/gw_level_trees", MODEL_PATH)
+
+# The pickled XGBoost model (and the xgboost import it drags in) is only
+# needed when there are no compiled trees or for very large batches.
+model = None
+model_sha256 = None
+model_lock = threading.Lock()
+
+
+def model_hash():
+    # Identifies the model stored results were computed with; compiled trees
+    # already carry the hash of the pickle they were exported from.
+    global model_sha256
+    if model_sha256 is None:
+        if compiled is not None:
+            model_sha256 = compiled.meta["source_sha256"]
+        else:
+            model_sha256 = tree_engine.file_sha256(MODEL_PATH)
+    return model_sha256
+
+
+def get_model():
+    global model
+    if model is None:
+        with model_lock:
+            if model is None:
+                import joblib
+
+                with timed(boot.stages, "pred_level.load_model"):
+                    model = joblib.load(MODEL_PATH, mmap_mode="r")
+    return model
 
 
 def classify_stage(stage):
@@ -15,8 +54,41 @@ def classify_stage(stage):
         return "Over-Exploited"
 
 
+# classify_stage over an array: bounds are inclusive upper limits, and NaN
+# sorts past the last one, matching the scalar version.
+STAGE_BOUNDS = np.array([70.0, 90.0, 100.0])
+STAGE_LABELS = np.array(["Safe", "Semi-Critical", "Critical", "Over-Exploited"], dtype=object)
+
+
+def stage_classes(stages):
+    return np.searchsorted(STAGE_BOUNDS, np.asarray(stages, dtype=np.float64), side="left")
+
+
+def classify_stages(stages):
+    return STAGE_LABELS[stage_classes(stages)]
+
+
+def predict_matrix(matrix):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if compiled is not None and len(matrix) <= tree_engine.COMPILED_MAX_ROWS:
+        return compiled.predict(matrix)
+    return get_model().predict(matrix)
+
+
+row_batcher = batcher.create("gw_level", predict_matrix)
+
+
+def predict_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, len(numeric_cols))
+    if row_batcher is not None:
+        return row_batcher.predict(matrix)
+    return predict_matrix(matrix)
+
+
 def predict_stage(sample):
-    pred_stage = model.predict([sample])[0]
+    pred_stage = predict_rows(sample)[0]
     category = classify_stage(pred_stage)
     return pred_stage, category
 
@@ -31,9 +103,41 @@ numeric_cols = [
 ]
 
 
+def analyze(level_input):
+    with metrics.stage("level_inference"):
+        predicted_stage, category = predict_stage(level_input)
+
+    return {"predicted_stage": float(predicted_stage), "classification": category}
+
+
 def predict(level_input):
-    predicted_stage, category = predict_stage(level_input)
+    if analysis_cache.cache is None:
+        return analyze(level_input)
+    key = analysis_cache.cache_key("gw_level", model_hash(), level_input)
+    return analysis_cache.cache.get_or_compute(key, lambda: analyze(level_input))
+
+
+def predict_batch_values(matrix, results=None):
+    # Predicted stages for a batch; with a results store, rows already scored
+    # by this model are read back instead of re-scored.
+    if results is None:
+        return predict_matrix(matrix), None
+    return results.score("gw_level", model_hash(), np.asarray(matrix), predict_matrix)
+
+
+def predict_batch(level_inputs):
+    pred_stages = predict_matrix(level_inputs)
+
+    return [
+        {"predicted_stage": stage, "classification": category}
+        for stage, category in zip(pred_stages.tolist(), classify_stages(pred_stages))
+    ]
+
+
+def warm_up():
+    predict_stage([0.0] * len(numeric_cols))
 
-    retJSON = {"predicted_stage": float(predicted_stage), "classification": category}
 
-    return json.dumps(retJSON)
+def preload():
+    get_model()
+    warm_up()
@@ -1,88 +1,94 @@
-import joblib
-import pandas as pd
+import multiprocessing
+import os
 import numpy as np
-import shap
-import json
-
-model = joblib.load("models/gw_quality.pkl")
-
-features = [
-    "pH",
-    "EC",
-    "TDS",
-    "TH",
-    "Ca",
-    "Mg",
-    "Na",
-    "K",
-    "Cl",
-    "SO4",
-    "NO3",
-    "F",
-    "U(ppb)",
-]
-
-LIMITS = {
-    "pH": (6.5, 8.5),
-    "TDS": 500,
-    "EC": 1500,
-    "TH": 300,
-    "Ca": 75,
-    "Mg": 30,
-    "Na": 200,
-    "K": 12,
-    "Cl": 250,
-    "SO4": 250,
-    "NO3": 45,
-    "F": 1.5,
-    "U(ppb)": 30,
-}
-
-TOXIC = {"NO3", "F", "U(ppb)"}
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import analysis_cache
+import batcher
+import boot
+import logs
+import metrics
+import quality_rules
+import tree_engine
+from timing import timed
+
+MODEL_PATH = "models/gw_quality.pkl"
+
+log = logs.get("pred_quality")
+
+# Array-backed copy of the forest exported by ml/export_trees.py; it skips
+# sklearn's per-call validation and dispatch and scores batches in one pass.
+with timed(boot.stages, "pred_quality.load_compiled"):
+    compiled = tree_engine.load_for("models/gw_quality_trees", MODEL_PATH)
+
+# The pickled forest and the SHAP explainer built from it are loaded on first
+# use; with compiled trees only explanations and very large batches need them.
+model = None
+model_sha256 = None
+explainer = None
+model_lock = threading.Lock()
+explainer_lock = threading.Lock()
+
+
+def model_hash():
+    global model_sha256
+    if model_sha256 is None:
+        if compiled is not None:
+            model_sha256 = compiled.meta["source_sha256"]
+        else:
+            model_sha256 = tree_engine.file_sha256(MODEL_PATH)
+    return model_sha256
+
+
+def get_model():
+    global model
+    if model is None:
+        with model_lock:
+            if model is None:
+                import joblib
+
+                with timed(boot.stages, "pred_quality.load_model"):
+                    loaded = joblib.load(MODEL_PATH, mmap_mode="r")
+                # Requests score one row at a time; fanning each predict out
+                # over a thread pool costs far more than the tree walk itself.
+                loaded.n_jobs = 1
+                model = loaded
+    return model
+
+
+def get_explainer():
+    # Building a TreeExplainer walks every tree in the forest, so it is done
+    # once per worker process and shared by all requests.
+    global explainer
+    if explainer is None:
+        with explainer_lock:
+            if explainer is None:
+                import shap
+
+                with timed(boot.stages, "pred_quality.build_explainer"):
+                    explainer = shap.TreeExplainer(get_model())
+    return explainer
+
+features = quality_rules.features
+LIMITS = quality_rules.LIMITS
+TOXIC = quality_rules.TOXIC
 
 
 def within_limit(col, val):
-    if col == "pH":
-        lo, hi = LIMITS["pH"]
-        return (val >= lo) and (val <= hi)
-    else:
-        return val <= LIMITS[col]
+    i = features.index(col)
+    return bool(quality_rules.LOWER[i] <= val <= quality_rules.UPPER[i])
 
 
 def compute_potability_score(row):
-    checks, passed = 0, 0
-    for col in features:
-        if within_limit(col, row[col]):
-            passed += 1
-        checks += 1
-    return 100.0 * passed / checks
+    return float(quality_rules.evaluate(row, failures=False).scores[0])
 
 
 def final_label(row):
-    if (
-        (row["NO3"] > LIMITS["NO3"])
-        or (row["F"] > LIMITS["F"])
-        or (row["U(ppb)"] > LIMITS["U(ppb)"])
-    ):
-        return "Critical"
-    if not (LIMITS["pH"][0] <= row["pH"] <= LIMITS["pH"][1]):
-        return "Critical"
-    for c in features:
-        if c == "pH":
-            continue
-        if row[c] > LIMITS[c]:
-            return "Critical"
-    return "Safe"
+    return quality_rules.evaluate(row, failures=False).labels[0]
 
 
 def recompute_rule_score(row_like_dict):
-    checks, passed = 0, 0
-    for col in features:
-        val = row_like_dict[col]
-        if within_limit(col, val):
-            passed += 1
-        checks += 1
-    return 100.0 * passed / checks
+    return compute_potability_score(row_like_dict)
 
 
 def what_if(original_row, **changes):
@@ -93,121 +99,351 @@ def what_if(original_row, **changes):
             raise ValueError(f"{k} not in features")
         new[k] = float(v)
 
-    base_rule = recompute_rule_score(base)
-    new_rule = recompute_rule_score(new)
-
-    base_pred = float(model.predict(pd.DataFrame([base]))[0])
-    new_pred = float(model.predict(pd.DataFrame([new]))[0])
-
-    def label_from_vals(vals):
-        if (
-            (vals["NO3"] > LIMITS["NO3"])
-            or (vals["F"] > LIMITS["F"])
-            or (vals["U(ppb)"] > LIMITS["U(ppb)"])
-        ):
-            return "Critical"
-        if not (LIMITS["pH"][0] <= vals["pH"] <= LIMITS["pH"][1]):
-            return "Critical"
-        for c in features:
-            if c == "pH":
-                continue
-            if vals[c] > LIMITS[c]:
-                return "Critical"
-        return "Safe"
-
-    base_label = label_from_vals(base)
-    new_label = label_from_vals(new)
+    both = quality_rules.to_matrix([[base[c] for c in features], [new[c] for c in features]])
+    rules = quality_rules.evaluate(both, failures=False)
+    base_pred, new_pred = (float(p) for p in predict_matrix(both))
+    base_rule, new_rule = (float(s) for s in rules.scores)
 
     return {
         "base_rule_score": base_rule,
         "new_rule_score": new_rule,
         "base_model_pred": base_pred,
         "new_model_pred": new_pred,
-        "base_label": base_label,
-        "new_label": new_label,
+        "base_label": rules.labels[0],
+        "new_label": rules.labels[1],
         "delta_rule": new_rule - base_rule,
         "delta_model": new_pred - base_pred,
     }
 
 
+# Upper bound on the points one sweep may score.
+SWEEP_MAX_POINTS = int(os.environ.get("AIGIS_SWEEP_MAX_POINTS", "100000"))
+
+
+def sweep_axis(spec):
+    # A grid axis is a list of values or {"start", "stop", "steps"}.
+    if isinstance(spec, dict):
+        if "values" in spec:
+            return np.asarray(spec["values"], dtype=np.float64)
+        return np.linspace(float(spec["start"]), float(spec["stop"]), int(spec.get("steps", 50)))
+    return np.asarray(spec, dtype=np.float64)
+
+
+def sweep(original_row, grid=None, random=None, samples=1000, seed=None):
+    # Scores a base sample against many perturbations in one batch. `grid`
+    # maps features to axes (see sweep_axis) and crosses them all; `random`
+    # maps features to {"low", "high"} (uniform) or {"sd"} (normal around the
+    # base value) and draws `samples` points.
+    base = quality_rules.to_matrix(original_row)[:1]
+    if bool(grid) == bool(random):
+        raise ValueError("Pass exactly one of grid or random")
+
+    spec = grid or random
+    for name in spec:
+        if name not in features:
+            raise ValueError(f"{name} not in features")
+    names = list(spec)
+    columns = [features.index(name) for name in names]
+
+    if grid:
+        axes = [sweep_axis(grid[name]) for name in names]
+        shape = tuple(len(axis) for axis in axes)
+        n_points = int(np.prod(shape))
+        if n_points > SWEEP_MAX_POINTS:
+            raise ValueError(f"Grid has {n_points} points; the limit is {SWEEP_MAX_POINTS}")
+        values = [v.ravel() for v in np.meshgrid(*axes, indexing="ij")]
+    else:
+        n_points = int(samples)
+        if n_points > SWEEP_MAX_POINTS:
+            raise ValueError(f"{n_points} samples requested; the limit is {SWEEP_MAX_POINTS}")
+        rng = np.random.default_rng(seed)
+        values = []
+        for name, j in zip(names, columns):
+            dist = random[name]
+            if "sd" in dist:
+                values.append(rng.normal(base[0, j], float(dist["sd"]), n_points))
+            else:
+                values.append(rng.uniform(float(dist["low"]), float(dist["high"]), n_points))
+
+    # Row 0 is the untouched base sample.
+    matrix = np.repeat(base, n_points + 1, axis=0)
+    for j, column in zip(columns, values):
+        matrix[1:, j] = column
+
+    preds = predict_matrix(matrix)
+    rules = quality_rules.evaluate(matrix, failures=False)
+    labels = rules.labels[1:]
+    base_label = rules.labels[0]
+    flipped = labels != base_label
+
+    result = {
+        "parameters": names,
+        "points": n_points,
+        "base": {
+            "model_pred": float(preds[0]),
+            "rule_score": float(rules.scores[0]),
+            "label": base_label,
+        },
+        "values": {name: column for name, column in zip(names, values)},
+        "model_pred": preds[1:],
+        "delta_model": preds[1:] - preds[0],
+        "rule_score": rules.scores[1:],
+        "delta_rule": rules.scores[1:] - rules.scores[0],
+        "label": labels.tolist(),
+        "flips": int(flipped.sum()),
+    }
+    if grid:
+        result["boundaries"] = label_boundaries(names, axes, labels.reshape(shape))
+    else:
+        result["nearest_flip"] = nearest_flip(names, base[0, columns], values, flipped)
+    return result
+
+
+def label_boundaries(names, axes, labels):
+    # Adjacent grid points along one axis whose labels differ.
+    boundaries = []
+    for k, (name, axis) in enumerate(zip(names, axes)):
+        before = np.take(labels, range(len(axis) - 1), axis=k)
+        after = np.take(labels, range(1, len(axis)), axis=k)
+        for index in zip(*np.nonzero(before != after)):
+            i = index[k]
+            boundaries.append(
+                {
+                    "parameter": name,
+                    "between": [float(axis[i]), float(axis[i + 1])],
+                    "at": {
+                        other: float(other_axis[index[m]])
+                        for m, (other, other_axis) in enumerate(zip(names, axes))
+                        if m != k
+                    },
+                    "from": before[index],
+                    "to": after[index],
+                }
+            )
+    return boundaries
+
+
+def nearest_flip(names, base_values, values, flipped):
+    # The flipped point closest to the base, with each parameter scaled by
+    # the spread of its draws.
+    if not flipped.any():
+        return None
+    points = np.stack(values, axis=1)
+    scale = points.std(axis=0)
+    scale[scale == 0] = 1.0
+    distance = np.linalg.norm((points - base_values) / scale, axis=1)
+    i = int(np.argmin(np.where(flipped, distance, np.inf)))
+    return {name: float(points[i, m]) for m, name in enumerate(names)}
+
+
 def failed_parameters(row):
-    fails = {}
-    if not (LIMITS["pH"][0] <= row["pH"] <= LIMITS["pH"][1]):
-        fails["pH"] = f"{row['pH']} (limit {LIMITS['pH'][0]}–{LIMITS['pH'][1]})"
-    for c in features:
-        if c == "pH":
-            continue
-        if row[c] > LIMITS[c]:
-            fails[c] = f"{row[c]} (limit {LIMITS[c]})"
-    return fails if fails else {"Status": "All within limits"}
-
-
-def explain_prediction(row):
-    try:
-        explainer = shap.TreeExplainer(model)
+    return quality_rules.evaluate(row).failed[0]
+
+
+def predict_matrix(matrix):
+    if compiled is not None and len(matrix) <= tree_engine.COMPILED_MAX_ROWS:
+        return compiled.predict(matrix)
+    import pandas as pd
+
+    return get_model().predict(pd.DataFrame(matrix, columns=features))
+
+
+# Single-row requests are coalesced into one batched predict when
+# AIGIS_BATCH_WINDOW_MS is set (see batcher.py).
+row_batcher = batcher.create("gw_quality", predict_matrix)
+
+
+def predict_rows(matrix):
+    if row_batcher is not None:
+        return row_batcher.predict(matrix)
+    return predict_matrix(matrix)
+
+
+# Exact SHAP over large batches can be split by row chunks across worker
+# processes; each builds its own explainer once. 0 keeps it in-process.
+EXPLAIN_WORKERS = int(os.environ.get("AIGIS_EXPLAIN_WORKERS", "0"))
+EXPLAIN_CHUNK_ROWS = int(os.environ.get("AIGIS_EXPLAIN_CHUNK_ROWS", "256"))
+# Exact SHAP costs ~100ms a row; larger batches are refused rather than
+# tying up a worker for minutes.
+EXPLAIN_MAX_EXACT_ROWS = int(os.environ.get("AIGIS_EXPLAIN_MAX_EXACT_ROWS", "1000"))
+explain_pool = None
+explain_pool_lock = threading.Lock()
+
 
-        x_row = row[features].values.reshape(1, -1)
+def get_explain_pool():
+    global explain_pool
+    with explain_pool_lock:
+        if explain_pool is None:
+            explain_pool = ProcessPoolExecutor(
+                max_workers=EXPLAIN_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=get_explainer,
+            )
+        return explain_pool
 
-        pred = float(model.predict(x_row)[0])
 
-        shap_vals = explainer.shap_values(x_row)[0]
+def shutdown_explain_pool():
+    global explain_pool
+    with explain_pool_lock:
+        if explain_pool is not None:
+            explain_pool.shutdown(cancel_futures=True)
+            explain_pool = None
 
-        contributions = dict(zip(features, shap_vals))
+
+def _shap_chunk(matrix):
+    tree_explainer = get_explainer()
+    with explainer_lock:
+        return tree_explainer.shap_values(matrix).astype(np.float32)
+
+
+def explain_matrix(matrix, mode="exact"):
+    # Contributions for a whole batch as one N x len(features) float32 array,
+    # in row and feature order; sorted_contributions() turns it into dicts.
+    matrix = quality_rules.to_matrix(matrix)
+    if mode == "fast" and compiled is not None:
+        return compiled.contributions(matrix)[0].astype(np.float32)
+    if len(matrix) > EXPLAIN_MAX_EXACT_ROWS:
+        raise ValueError(
+            f"{len(matrix)} rows for exact explanations; the limit is {EXPLAIN_MAX_EXACT_ROWS}"
+        )
+    if len(matrix) <= EXPLAIN_CHUNK_ROWS:
+        return _shap_chunk(matrix)
+    chunks = [
+        matrix[start : start + EXPLAIN_CHUNK_ROWS]
+        for start in range(0, len(matrix), EXPLAIN_CHUNK_ROWS)
+    ]
+    if EXPLAIN_WORKERS > 1:
+        return np.concatenate(list(get_explain_pool().map(_shap_chunk, chunks)))
+    # The lock is taken per chunk, so single-row requests in this worker wait
+    # for one chunk at most, not the whole batch.
+    return np.concatenate([_shap_chunk(chunk) for chunk in chunks])
+
+
+def sorted_contributions(values):
+    names = np.array(features, dtype=object)
+    order = np.argsort(-np.abs(values), axis=1, kind="stable")
+    return [dict(zip(names[o], row[o].tolist())) for row, o in zip(values, order)]
+
+
+def fast_contributions(matrix):
+    # Saabas attributions from the compiled trees: one walk per tree instead
+    # of SHAP's path enumeration, at the cost of exact Shapley fairness.
+    if compiled is None:
+        tree_explainer = get_explainer()
+        with explainer_lock:
+            return tree_explainer.shap_values(matrix)
+    return compiled.contributions(matrix)[0]
+
+
+def explain_prediction(row, pred=None, mode="exact"):
+    if mode == "none":
+        return None
+
+    x_row = quality_rules.to_matrix(row)
+    if pred is None:
+        pred = float(predict_rows(x_row)[0])
+
+    try:
+        if mode == "fast":
+            values = fast_contributions(x_row)[0]
+        else:
+            tree_explainer = get_explainer()
+            with explainer_lock:
+                values = tree_explainer.shap_values(x_row)[0]
+
+        contributions = dict(zip(features, values.tolist()))
         sorted_contribs = dict(
             sorted(contributions.items(), key=lambda kv: abs(kv[1]), reverse=True)
         )
 
         return {"Predicted Score": pred, "Contributions": sorted_contribs}
     except ImportError:
-        x_row = row[features].values.reshape(1, -1)
-        pred = float(model.predict(x_row)[0])
-
         return {
             "Predicted Score": pred,
             "Contributions": "SHAP not available - install with: pip install shap",
         }
 
 
-def analyze_sample(sample_data):
-    if isinstance(sample_data, dict):
-        sample_data = pd.Series(sample_data)
+def analyze_sample(sample_data, timings=None, explain="exact"):
+    if timings is None:
+        timings = {}
 
-    sample_df = pd.DataFrame([sample_data])[features]
-    model_score = model.predict(sample_df)[0]
+    with timed(timings, "prepare"):
+        x_row = quality_rules.to_matrix(sample_data)
 
-    rule_score = compute_potability_score(sample_data)
+    with timed(timings, "inference"):
+        model_score = float(predict_rows(x_row)[0])
 
-    safety_label = final_label(sample_data)
+    with timed(timings, "rules"):
+        rules = quality_rules.evaluate(x_row)
 
-    failed_params = failed_parameters(sample_data)
-
-    explanation = explain_prediction(sample_data)
+    with timed(timings, "explanation"):
+        explanation = explain_prediction(x_row, pred=model_score, mode=explain)
 
     return {
-        "model_score": float(model_score),
-        "rule_score": float(rule_score),
-        "safety_label": safety_label,
-        "failed_parameters": failed_params,
+        "model_score": model_score,
+        "rule_score": float(rules.scores[0]),
+        "safety_label": rules.labels[0],
+        "failed_parameters": rules.failed[0],
         "explanation": explanation,
+        "timings_ms": timings,
     }
 
 
-def predict(pred_input):
-    input_df = pd.DataFrame([pred_input])[features]
-
-    pred_score = model.predict(input_df)[0]
-    print(f"Predicted Potability Score: {pred_score:.2f}")
+def predict(pred_input, explain="exact"):
+    x_row = quality_rules.to_matrix(pred_input)
+    if analysis_cache.cache is not None:
+        key = analysis_cache.cache_key("gw_quality", model_hash(), x_row, explain)
+        cached = analysis_cache.cache.get(key)
+        if cached is not None:
+            logs.sampled(log, "quality_analysis", explain=explain, cached=True)
+            return cached
 
-    print("=== Complete Water Quality Analysis ===")
-    input_series = pd.Series(pred_input)
-    analysis = analyze_sample(input_series)
+    analysis = analyze_sample(x_row, explain=explain)
+    timings = analysis["timings_ms"]
+    for stage, ms in timings.items():
+        metrics.observe(f"explain_{explain}" if stage == "explanation" else f"quality_{stage}", ms)
+    logs.sampled(log, "quality_analysis", explain=explain, cached=False, timings_ms=timings)
 
-    retJSON = {
+    result = {
         "potability_score": analysis["model_score"],
         "rule_based_score": analysis["rule_score"],
         "safety_label": analysis["safety_label"],
         "failed_parameters": analysis["failed_parameters"],
         "explanation": analysis["explanation"],
     }
+    if analysis_cache.cache is not None:
+        analysis_cache.cache.put(key, result)
+    return result
 
-    return json.dumps(retJSON)
+
+def warm_up():
+    sample = {c: 0.0 for c in features}
+    sample["pH"] = 7.0
+    analyze_sample(sample)
+
+
+def preload():
+    # Loads everything up front; used in the gunicorn master so the forked
+    # workers share the model pages instead of each loading a copy.
+    get_model()
+    get_explainer()
+    warm_up()
+
+
+def predict_batch(input_df):
+    matrix = quality_rules.to_matrix(input_df)
+    pred_scores = predict_matrix(matrix).tolist()
+    rules = quality_rules.evaluate(matrix)
+
+    return [
+        {
+            "potability_score": pred_score,
+            "rule_based_score": rule_score,
+            "safety_label": label,
+            "failed_parameters": failed,
+        }
+        for pred_score, rule_score, label, failed in zip(
+            pred_scores, rules.scores.tolist(), rules.labels, rules.failed
+        )
+    ]
@@ -0,0 +1,106 @@
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Sampled request profiler. For a fraction of requests a thread samples the
+# stacks of every thread running code from this directory every
+# `interval_ms` until the response is sent, and writes them as folded stacks
+# (one "frame;frame;frame count" line each) that flamegraph.pl or
+# speedscope read directly. Requests that are not sampled cost one
+# random() call.
+#
+#   AIGIS_PROFILE_SAMPLE=0.01 AIGIS_PROFILE_DIR=profiles AIGIS_PROFILE_KEEP=100
+
+SAMPLE = float(os.environ.get("AIGIS_PROFILE_SAMPLE", "0"))
+DIRECTORY = os.environ.get("AIGIS_PROFILE_DIR", "profiles")
+KEEP = int(os.environ.get("AIGIS_PROFILE_KEEP", "100"))
+INTERVAL_MS = float(os.environ.get("AIGIS_PROFILE_INTERVAL_MS", "1"))
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+SKIP = {os.path.abspath(__file__)}
+# Background threads of this app that only ever wait on a queue.
+IDLE_THREADS = ("log-writer", "batcher-", "profiler")
+
+
+def folded(frame):
+    stack = []
+    ours = False
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename in SKIP:
+            return None
+        ours = ours or code.co_filename.startswith(SOURCE_DIR)
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack)) if ours else None
+
+
+class Profile:
+    def __init__(self, directory, interval_ms):
+        self.directory = directory
+        self.interval = interval_ms / 1000.0
+        self.stacks = Counter()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.done.wait(self.interval):
+            idle = {t.ident for t in threading.enumerate() if t.name.startswith(IDLE_THREADS)}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in idle:
+                    continue
+                stack = folded(frame)
+                if stack is not None:
+                    self.stacks[stack] += 1
+
+    def finish(self, name, elapsed):
+        self.done.set()
+        self.thread.join()
+        if not self.stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        label = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+        path = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}-{label}.folded",
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# {name} {elapsed * 1000.0:.1f} ms\n")
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        prune(self.directory, KEEP)
+        return path
+
+
+def prune(directory, keep):
+    with os.scandir(directory) as entries:
+        files = sorted(
+            (e for e in entries if e.name.endswith(".folded")),
+            key=lambda e: e.stat().st_mtime,
+        )
+    for entry in files[:-keep] if keep else files:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class RequestProfiler:
+    def __init__(self, sample=SAMPLE, directory=DIRECTORY, interval_ms=INTERVAL_MS):
+        self.sample = sample
+        self.directory = directory
+        self.interval_ms = interval_ms
+
+    def maybe_start(self):
+        if self.sample <= 0 or random.random() >= self.sample:
+            return None
+        return Profile(self.directory, self.interval_ms)
+
+
+def create():
+    return RequestProfiler() if SAMPLE > 0 else None
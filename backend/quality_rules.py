@@ -0,0 +1,103 @@
+import numpy as np
+from collections import namedtuple
+
+features = [
+    "pH",
+    "EC",
+    "TDS",
+    "TH",
+    "Ca",
+    "Mg",
+    "Na",
+    "K",
+    "Cl",
+    "SO4",
+    "NO3",
+    "F",
+    "U(ppb)",
+]
+
+LIMITS = {
+    "pH": (6.5, 8.5),
+    "TDS": 500,
+    "EC": 1500,
+    "TH": 300,
+    "Ca": 75,
+    "Mg": 30,
+    "Na": 200,
+    "K": 12,
+    "Cl": 250,
+    "SO4": 250,
+    "NO3": 45,
+    "F": 1.5,
+    "U(ppb)": 30,
+}
+
+TOXIC = {"NO3", "F", "U(ppb)"}
+
+# LIMITS compiled into per-column bounds in `features` order. Single-valued
+# limits are upper bounds only.
+LOWER = np.array(
+    [LIMITS[c][0] if isinstance(LIMITS[c], tuple) else -np.inf for c in features]
+)
+UPPER = np.array(
+    [LIMITS[c][1] if isinstance(LIMITS[c], tuple) else LIMITS[c] for c in features]
+)
+LIMIT_TEXT = [
+    f"{LIMITS[c][0]}–{LIMITS[c][1]}" if isinstance(LIMITS[c], tuple) else f"{LIMITS[c]}"
+    for c in features
+]
+
+LABELS = np.array(["Critical", "Safe"], dtype=object)
+
+RuleResult = namedtuple("RuleResult", ["pass_mask", "scores", "labels", "failed"])
+
+
+def to_matrix(rows):
+    if hasattr(rows, "columns"):
+        return rows[features].to_numpy(dtype=np.float64)
+    if hasattr(rows, "keys"):
+        return np.array([[float(rows[c]) for c in features]], dtype=np.float64)
+
+    matrix = np.asarray(rows, dtype=np.float64)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    return matrix
+
+
+def pass_mask(matrix):
+    return (matrix >= LOWER) & (matrix <= UPPER)
+
+
+def potability_scores(mask):
+    return 100.0 * mask.sum(axis=1) / len(features)
+
+
+def safety_labels(mask):
+    return LABELS[mask.all(axis=1).astype(np.intp)]
+
+
+def failure_lists(matrix, mask):
+    failed = [{"Status": "All within limits"} for _ in range(len(matrix))]
+
+    rows, cols = np.nonzero(~mask)
+    values = matrix[rows, cols].tolist()
+    for row, col, value in zip(rows.tolist(), cols.tolist(), values):
+        fails = failed[row]
+        if "Status" in fails:
+            fails = failed[row] = {}
+        fails[features[col]] = f"{value} (limit {LIMIT_TEXT[col]})"
+
+    return failed
+
+
+def evaluate(rows, failures=True):
+    matrix = to_matrix(rows)
+    mask = pass_mask(matrix)
+
+    return RuleResult(
+        pass_mask=mask,
+        scores=potability_scores(mask),
+        labels=safety_labels(mask),
+        failed=failure_lists(matrix, mask) if failures else None,
+    )
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import time
+
+import ai_report
+import report_store
+
+# Keys that change on every request without changing the report itself.
+IGNORED_KEYS = {"timestamp"}
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {
+            str(k): normalize(v)
+            for k, v in sorted(value.items())
+            if k not in IGNORED_KEYS
+        }
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, str):
+        value = value.strip()
+        # /analyze and /predict responses nest JSON-encoded strings, so
+        # formatting differences inside them should not change the key.
+        if value[:1] in ("{", "["):
+            try:
+                return normalize(json.loads(value))
+            except ValueError:
+                pass
+        return value
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+def cache_key(data):
+    payload = {
+        "model": ai_report.MODEL,
+        "language": str(data.get("language", "English")).strip().lower(),
+        "reason": str(data.get("reason", "")).strip().lower(),
+        "data": normalize(
+            {k: v for k, v in data.items() if k not in ("language", "reason")}
+        ),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ReportCache:
+    # One small JSON file per key pointing at the rendered report. The file's
+    # mtime doubles as the last-used time for LRU eviction. Evicting an entry
+    # leaves the report itself alone: job records may still point at it, and
+    # ReportStore ages reports out on its own.
+
+    def __init__(self, cache_dir="report_cache", max_entries=256, max_age=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        entry_path = self._path(key)
+        try:
+            with open(entry_path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if time.time() - entry["created"] > self.max_age or not os.path.exists(
+            entry["path"]
+        ):
+            self._remove(entry_path)
+            return None
+
+        os.utime(entry_path)
+        return entry["path"]
+
+    def put(self, key, path):
+        entry = {"path": path, "created": time.time()}
+        with report_store.atomic_path(self._path(key)) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            entry_path = os.path.join(self.cache_dir, name)
+            if name.startswith(report_store.TMP_PREFIX):
+                try:
+                    if report_store.is_stale_tmp(name, os.path.getmtime(entry_path), now):
+                        self._remove(entry_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(entry_path, encoding="utf-8") as f:
+                    entry = json.load(f)
+                last_used = os.path.getmtime(entry_path)
+            except (FileNotFoundError, ValueError):
+                continue
+
+            if now - entry["created"] > self.max_age:
+                self._remove(entry_path)
+            else:
+                entries.append((last_used, entry_path))
+
+        entries.sort()
+        for _, entry_path in entries[: max(0, len(entries) - self.max_entries)]:
+            self._remove(entry_path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remove(self, entry_path):
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
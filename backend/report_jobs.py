@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import ai_report
+import logs
+import metrics
+import report_cache
+import report_store
+
+log = logs.get("report_jobs")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ReportJobs:
+    # Job state is kept as small JSON files so that any gunicorn worker can
+    # answer a status request, not only the one running the job. The files
+    # are shared by all workers, so they are never cleared wholesale; evict()
+    # expires them by age and count instead.
+
+    def __init__(
+        self,
+        jobs_dir="jobs",
+        max_workers=2,
+        max_pending=16,
+        llm_client=None,
+        cache=None,
+        store=None,
+        max_age=24 * 3600,
+        max_files=10000,
+        stale_after=1800,
+    ):
+        self.jobs_dir = jobs_dir
+        self.max_age = max_age
+        self.max_files = max_files
+        # A job still queued or running after this long belonged to a worker
+        # that died; it is marked failed so pollers stop waiting.
+        self.stale_after = stale_after
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.llm_client = llm_client
+        self.cache = cache
+        self.store = store or report_store.ReportStore()
+        self.pdf_pool = None
+        self.llm_slots = None
+        self.tasks = {}
+
+    def start(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.llm_slots = asyncio.Semaphore(self.max_workers)
+        self.pdf_pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def stop(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        if self.pdf_pool is not None:
+            self.pdf_pool.shutdown(cancel_futures=True)
+            self.pdf_pool = None
+
+    def submit(self, data):
+        if len(self.tasks) >= self.max_pending:
+            raise QueueFull(f"{len(self.tasks)} reports already pending")
+
+        job_id = uuid.uuid4().hex
+        key = None
+        if self.cache is not None:
+            key = report_cache.cache_key(data)
+            path = self.cache.get(key)
+            if path is not None:
+                self._write(job_id, {"status": "done", "url": path, "cached": True})
+                return job_id
+
+        self._write(job_id, {"status": "queued"})
+
+        task = asyncio.create_task(self._run(job_id, data, key))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+        return job_id
+
+    async def stream(self, data):
+        # Yields (event, payload) pairs: markdown chunks as the model produces
+        # them, then the rendered report once the full text is available.
+        key = None
+        if self.cache is not None:
+            key = report_cache.cache_key(data)
+            path = self.cache.get(key)
+            if path is not None:
+                yield "done", {"url": path, "cached": True}
+                return
+
+        chunks = []
+        async with self.llm_slots:
+            with metrics.stage("llm_stream"):
+                async for text in ai_report.astream_markdown(data, self.llm_client):
+                    chunks.append(text)
+                    yield "chunk", {"text": text}
+
+        loop = asyncio.get_running_loop()
+        with metrics.stage("pdf_render"):
+            path = await loop.run_in_executor(
+                self.pdf_pool,
+                ai_report.render_report,
+                "".join(chunks),
+                report_store.new_report_name(),
+                self.store.directory,
+            )
+        if key is not None:
+            self.cache.put(key, path)
+        yield "done", {"url": path}
+
+    def status(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def _run(self, job_id, data, key=None):
+        try:
+            async with self.llm_slots:
+                self._write(job_id, {"status": "running"})
+                with metrics.stage("llm"):
+                    markdown_content = await ai_report.agenerate_markdown(
+                        data, self.llm_client
+                    )
+
+            loop = asyncio.get_running_loop()
+            with metrics.stage("pdf_render"):
+                path = await loop.run_in_executor(
+                    self.pdf_pool,
+                    ai_report.render_report,
+                    markdown_content,
+                    report_store.new_report_name(),
+                    self.store.directory,
+                )
+            if key is not None:
+                self.cache.put(key, path)
+            self._write(job_id, {"status": "done", "url": path})
+        except asyncio.CancelledError:
+            self._write(job_id, {"status": "failed", "error": "cancelled"})
+            raise
+        except Exception as e:
+            logs.event(log, "report_failed", logging.ERROR, job_id=job_id, error=str(e))
+            self._write(job_id, {"status": "failed", "error": str(e)})
+
+    def evict(self):
+        now = time.time()
+        files = []
+        with os.scandir(self.jobs_dir) as entries:
+            for entry in entries:
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(report_store.TMP_PREFIX):
+                    if report_store.is_stale_tmp(entry.name, mtime, now):
+                        self._remove(entry.path)
+                elif entry.name.endswith(".json"):
+                    files.append((mtime, entry.path, entry.name[: -len(".json")]))
+
+        files.sort()
+        excess = len(files) - self.max_files
+        for mtime, path, job_id in files:
+            if job_id in self.tasks:
+                continue
+            if now - mtime > self.max_age or excess > 0:
+                self._remove(path)
+                excess -= 1
+            elif now - mtime > self.stale_after:
+                job = self.status(job_id)
+                if job is not None and job["status"] in ("queued", "running"):
+                    self._write(job_id, {"status": "failed", "error": "interrupted"})
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _write(self, job_id, state):
+        state = {"job_id": job_id, "updated": time.time(), **state}
+        with report_store.atomic_path(self._path(job_id)) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import logs
+
+TMP_PREFIX = ".tmp-"
+# Temporary files older than this were left behind by a crashed writer.
+TMP_MAX_AGE = 3600
+
+log = logs.get("report_store")
+
+
+def new_report_name():
+    return f"report_{uuid.uuid4().hex}"
+
+
+@contextmanager
+def atomic_path(path):
+    # Writers fill a hidden temporary file next to the target and it is
+    # renamed into place only once complete, so readers never see a partial
+    # report.
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f"{TMP_PREFIX}{uuid.uuid4().hex}-{name}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def is_stale_tmp(name, mtime, now):
+    return name.startswith(TMP_PREFIX) and now - mtime > TMP_MAX_AGE
+
+
+async def run_eviction(evict, interval, name):
+    # Runs `evict` off the event loop every `interval` seconds until cancelled.
+    while True:
+        try:
+            await asyncio.to_thread(evict)
+        except Exception as e:
+            logs.event(log, f"{name}_eviction_failed", logging.WARNING, error=str(e))
+        await asyncio.sleep(interval)
+
+
+class ReportStore:
+    def __init__(self, directory="static", max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def files(self):
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+        return found
+
+    def usage(self):
+        files = [f for f in self.files() if not f[3].startswith(TMP_PREFIX)]
+        return {
+            "files": len(files),
+            "bytes": sum(size for _, size, _, _ in files),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+    def evict(self):
+        now = time.time()
+        kept = []
+        for mtime, size, path, name in self.files():
+            # Temporary files belong to in-flight renders; only clear ones
+            # left behind by a crashed writer.
+            if name.startswith(TMP_PREFIX):
+                if is_stale_tmp(name, mtime, now):
+                    self._remove(path, size)
+            elif now - mtime > self.max_age:
+                self._remove(path, size)
+            else:
+                kept.append((mtime, size, path))
+
+        kept.sort()
+        total = sum(size for _, size, _ in kept)
+        for _, size, path in kept:
+            if total <= self.max_bytes:
+                break
+            self._remove(path, size)
+            total -= size
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.evicted_files += 1
+        self.evicted_bytes += size
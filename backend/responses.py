@@ -0,0 +1,40 @@
+import json
+
+import metrics
+import orjson
+from fastapi.responses import Response
+
+
+def dumps(content):
+    with metrics.stage("serialize"):
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+class NativeJSONResponse(Response):
+    # Serializes the handler's result exactly once with orjson. NumPy scalars
+    # and arrays are encoded natively, so handlers can return model outputs
+    # without converting them first.
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+def analysis_response(quality_analysis, level_analysis, legacy=False):
+    if legacy:
+        # Format used before native JSON responses: each analysis JSON-encoded
+        # into a string, the wrapper encoded again and then once more by
+        # FastAPI when returning the string.
+        with metrics.stage("serialize"):
+            return json.dumps(
+                {
+                    "quality_analysis": json.dumps(quality_analysis, default=float),
+                    "level_analysis": json.dumps(level_analysis, default=float),
+                }
+            )
+
+    return NativeJSONResponse(
+        {"quality_analysis": quality_analysis, "level_analysis": level_analysis}
+    )
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import boot
+import numpy as np
+
+# Persisted model outputs keyed by (model, model hash, row content hash).
+# Batch scoring looks every row up first and only runs the model on rows it
+# has not seen with the current model, so a dataset update re-scores the
+# changed rows and a new model re-scores everything once. Rows scored by
+# earlier versions of a model are deleted after the first successful score
+# with a new one.
+
+LOOKUP_CHUNK = 500
+
+
+def row_hashes(matrix):
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in matrix]
+
+
+class ResultStore:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("AIGIS_RESULTS_DB", "results/results.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        # One connection per process: a connection opened in the gunicorn
+        # master must not be reused by the forked workers.
+        self.db = boot.PerProcess(self._open)
+        # (model, model_hash) pairs whose older rows this process has pruned.
+        self.pruned = set()
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets several workers read while one writes.
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " model TEXT NOT NULL, model_hash TEXT NOT NULL, row_hash BLOB NOT NULL,"
+            " value REAL, created REAL NOT NULL,"
+            " PRIMARY KEY (model, model_hash, row_hash))"
+        )
+        db.commit()
+        return db
+
+    def connect(self):
+        # Call with the lock.
+        return self.db.get()
+
+    def lookup(self, model, model_hash, hashes):
+        found = {}
+        with self.lock:
+            db = self.connect()
+            for start in range(0, len(hashes), LOOKUP_CHUNK):
+                chunk = hashes[start : start + LOOKUP_CHUNK]
+                rows = db.execute(
+                    "SELECT row_hash, value FROM results WHERE model = ? AND model_hash = ?"
+                    f" AND row_hash IN ({','.join('?' * len(chunk))})",
+                    [model, model_hash, *chunk],
+                )
+                found.update(rows)
+        return found
+
+    def store(self, model, model_hash, hashes, values):
+        now = time.time()
+        with self.lock:
+            db = self.connect()
+            db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                [
+                    (model, model_hash, h, None if np.isnan(v) else float(v), now)
+                    for h, v in zip(hashes, values)
+                ],
+            )
+            db.commit()
+
+    def prune(self, model, model_hash):
+        # Deletes rows of `model` scored by any other model hash.
+        if (model, model_hash) in self.pruned:
+            return 0
+        with self.lock:
+            db = self.connect()
+            deleted = db.execute(
+                "DELETE FROM results WHERE model = ? AND model_hash != ?", (model, model_hash)
+            ).rowcount
+            db.commit()
+            self.pruned.add((model, model_hash))
+        return deleted
+
+    def score(self, model, model_hash, matrix, predict):
+        # Returns predict(matrix) for every row, plus what was recomputed.
+        start = time.perf_counter()
+        hashes = row_hashes(matrix)
+        unique = list(dict.fromkeys(hashes))
+        found = self.lookup(model, model_hash, unique)
+
+        missing = [h for h in unique if h not in found]
+        if missing:
+            first_row = {}
+            for i, h in enumerate(hashes):
+                first_row.setdefault(h, i)
+            fresh = np.asarray(predict(matrix[[first_row[h] for h in missing]]), dtype=np.float64)
+            self.store(model, model_hash, missing, fresh)
+            found.update(zip(missing, fresh.tolist()))
+
+        values = np.array(
+            [np.nan if found[h] is None else found[h] for h in hashes], dtype=np.float64
+        )
+        stats = {
+            "model": model,
+            "model_hash": model_hash,
+            "rows": len(hashes),
+            "unique_rows": len(unique),
+            "reused": len(unique) - len(missing),
+            "recomputed": len(missing),
+            "pruned": self.prune(model, model_hash),
+            "ms": round((time.perf_counter() - start) * 1000.0, 3),
+        }
+        return values, stats
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pred_level
+import pred_quality
+import quality_rules
+import schemas
+
+# Projects many future scenarios for one /predict request. Every scenario
+# and every year of its horizon becomes one row of a single quality matrix
+# and one row of a single level matrix, so each model scores the whole
+# request in one batch.
+#
+# In a scenario, groundwaterParameters are yearly increments added to the
+# existing level inputs (applied once without a horizon), and quality fields
+# are the values expected at the end of the horizon, reached linearly from
+# the existing sample. Blank quality fields keep their existing value.
+
+MAX_ROWS = int(os.environ.get("AIGIS_SCENARIO_MAX_ROWS", "10000"))
+
+
+def scenario_inputs(existing_quality, for_prediction):
+    quality = schemas.QUALITY.overlay(existing_quality, for_prediction)
+    level_delta = schemas.LEVEL.parse(
+        schemas.parameter_values(for_prediction.get("groundwaterParameters"))
+    )
+    return quality, level_delta
+
+
+def transitions(years, baseline, labels):
+    steps = [0] + list(years)
+    sequence = [baseline] + list(labels)
+    return [
+        {"year": steps[i], "from": sequence[i - 1], "to": sequence[i]}
+        for i in range(1, len(sequence))
+        if sequence[i] != sequence[i - 1]
+    ]
+
+
+def project(existing, scenarios, horizon_years=None):
+    if not isinstance(scenarios, list) or not scenarios:
+        raise schemas.InvalidInput("Expected a non-empty list of scenarios")
+    if horizon_years is not None:
+        try:
+            horizon_years = int(horizon_years)
+        except (TypeError, ValueError):
+            horizon_years = 0
+        if not 1 <= horizon_years <= 100:
+            raise schemas.InvalidInput("horizon_years must be between 1 and 100")
+
+    years = np.arange(1, horizon_years + 1) if horizon_years else np.array([1])
+    n_rows = 1 + len(scenarios) * len(years)
+    if n_rows > MAX_ROWS:
+        raise schemas.InvalidInput(f"{n_rows} projected rows; the limit is {MAX_ROWS}")
+
+    existing_quality = schemas.QUALITY.parse(existing)
+    existing_level = schemas.LEVEL.parse(existing)
+
+    # Row 0 is the existing sample; scenario i fills rows 1 + i*T .. 1 + (i+1)*T.
+    quality = np.repeat(existing_quality, n_rows, axis=0)
+    level = np.repeat(existing_level, n_rows, axis=0)
+    fraction = (years / years[-1])[:, None]
+    for i, scenario in enumerate(scenarios):
+        if not isinstance(scenario, dict):
+            raise schemas.InvalidInput(f"Scenario {i}: expected an object")
+        target, delta = scenario_inputs(existing_quality, scenario)
+        block = slice(1 + i * len(years), 1 + (i + 1) * len(years))
+        quality[block] = existing_quality + fraction * (target - existing_quality)
+        level[block] = existing_level + years[:, None] * delta
+
+    potability = pred_quality.predict_matrix(quality)
+    rules = quality_rules.evaluate(quality, failures=False)
+    stages = pred_level.predict_matrix(level)
+    classes = pred_level.classify_stages(stages).tolist()
+
+    # Failure details only for the rows that are returned in full.
+    final_rows = [0] + [(i + 1) * len(years) for i in range(len(scenarios))]
+    failed = quality_rules.evaluate(quality[final_rows]).failed
+
+    def analyses(row, failed_parameters):
+        return {
+            "quality_analysis": {
+                "potability_score": float(potability[row]),
+                "rule_based_score": float(rules.scores[row]),
+                "safety_label": rules.labels[row],
+                "failed_parameters": failed_parameters,
+            },
+            "level_analysis": {
+                "predicted_stage": float(stages[row]),
+                "classification": classes[row],
+            },
+        }
+
+    results = []
+    for i, scenario in enumerate(scenarios):
+        block = slice(1 + i * len(years), 1 + (i + 1) * len(years))
+        result = {"name": scenario.get("name") or f"Scenario {i + 1}"}
+        result.update(analyses(final_rows[i + 1], failed[i + 1]))
+        result["trajectory"] = {
+            "year": years,
+            "potability_score": potability[block],
+            "rule_based_score": rules.scores[block],
+            "safety_label": rules.labels[block].tolist(),
+            "predicted_stage": stages[block],
+            "classification": classes[block],
+        }
+        result["transitions"] = {
+            "quality": transitions(years.tolist(), rules.labels[0], rules.labels[block]),
+            "level": transitions(years.tolist(), classes[0], classes[block]),
+        }
+        results.append(result)
+
+    return {"baseline": analyses(0, failed[0]), "scenarios": results}
@@ -0,0 +1,129 @@
+import numpy as np
+from collections import namedtuple
+
+Field = namedtuple("Field", ["name", "aliases", "dtype", "default"])
+
+
+class InvalidInput(ValueError):
+    pass
+
+
+class Schema:
+    # Maps request keys onto a model's feature columns. Parsing writes
+    # straight into a C-contiguous float64 matrix in column order, which is
+    # what the models and the rule engine consume.
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = [f.name for f in fields]
+        # Aliases win over the column name, matching what the dashboard sends.
+        self.keys = [f.aliases + (f.name,) for f in fields]
+        self.names = {key: f.name for f, keys in zip(fields, self.keys) for key in keys}
+
+    def __len__(self):
+        return len(self.fields)
+
+    def column(self, key):
+        # Column name for a request key or alias.
+        try:
+            return self.names[key]
+        except KeyError:
+            raise InvalidInput(f"Unknown parameter '{key}'")
+
+    def parse(self, data):
+        matrix = np.empty((1, len(self.fields)), dtype=np.float64)
+        self._fill(matrix[0], data or {}, None)
+        return matrix
+
+    def overlay(self, base, data):
+        # Copy of a parsed row with only the fields present in `data` replaced;
+        # used for future values where a blank field means "unchanged".
+        matrix = np.array(base, dtype=np.float64).reshape(1, len(self.fields))
+        self._fill(matrix[0], data or {}, None, keep_missing=True)
+        return matrix
+
+    def parse_many(self, records):
+        matrix = np.empty((len(records), len(self.fields)), dtype=np.float64)
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                raise InvalidInput(f"Sample {i}: expected an object")
+            self._fill(matrix[i], record, i)
+        return matrix
+
+    def parse_frame(self, frame):
+        import pandas as pd
+
+        matrix = np.empty((len(frame), len(self.fields)), dtype=np.float64)
+        for j, (field, keys) in enumerate(zip(self.fields, self.keys)):
+            column = next((k for k in keys if k in frame.columns), None)
+            if column is None:
+                matrix[:, j] = field.default
+                continue
+            try:
+                values = pd.to_numeric(frame[column]).to_numpy(dtype=field.dtype)
+            except (TypeError, ValueError) as e:
+                raise InvalidInput(f"Column '{column}': {e}")
+            matrix[:, j] = np.where(np.isnan(values), field.default, values)
+        return matrix
+
+    def _fill(self, row, data, index, keep_missing=False):
+        for j, (field, keys) in enumerate(zip(self.fields, self.keys)):
+            raw = None
+            for key in keys:
+                raw = data.get(key)
+                if raw is not None:
+                    break
+            if raw is None or raw == "":
+                if not keep_missing:
+                    row[j] = field.default
+                continue
+            try:
+                row[j] = field.dtype(raw)
+            except (TypeError, ValueError):
+                where = f"Sample {index}: " if index is not None else ""
+                raise InvalidInput(f"{where}invalid value for '{key}': {raw!r}")
+
+
+def parameter_values(parameters):
+    # PredictionForm sends level parameters as [{"type": ..., "value": ...}].
+    return {p["type"]: p["value"] for p in parameters or [] if "type" in p}
+
+
+QUALITY = Schema(
+    [
+        Field("pH", ("ph",), float, 0.0),
+        Field("EC", ("ec",), float, 0.0),
+        Field("TDS", ("tds",), float, 0.0),
+        Field("TH", ("th",), float, 0.0),
+        Field("Ca", ("ca",), float, 0.0),
+        Field("Mg", ("mg",), float, 0.0),
+        Field("Na", ("na",), float, 0.0),
+        Field("K", ("k",), float, 0.0),
+        Field("Cl", ("cl",), float, 0.0),
+        Field("SO4", ("so4",), float, 0.0),
+        Field("NO3", ("nitrate",), float, 0.0),
+        Field("F", ("fluoride",), float, 0.0),
+        Field("U(ppb)", ("uranium",), float, 0.0),
+    ]
+)
+
+LEVEL = Schema(
+    [
+        Field("Annual Domestic and Industry Draft", ("annualDomesticIndustryDraft",), float, 0.0),
+        Field("Annual Irrigation Draft", ("annualIrrigationDraft",), float, 0.0),
+        Field("Annual Groundwater Draft (Total)", ("annualGroundwaterDraftTotal",), float, 0.0),
+        Field(
+            "Annual Replenishable Groundwater Resources (Total)",
+            ("annualReplenishableGroundwaterResources",),
+            float,
+            0.0,
+        ),
+        Field(
+            "Natural Discharge During Non-Monsoon Season",
+            ("naturalDischargeNonMonsoon",),
+            float,
+            0.0,
+        ),
+        Field("Net Groundwater Availability", ("netGroundwaterAvailability",), float, 0.0),
+    ]
+)
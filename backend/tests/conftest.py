@@ -0,0 +1,11 @@
+import os
+import sys
+import warnings
+
+# The backend loads its models relative to its own directory.
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.chdir(BACKEND)
+os.environ.setdefault("AIGIS_WARMUP", "off")
+os.environ.setdefault("AIGIS_LOG_SAMPLE", "0")
+warnings.filterwarnings("ignore", module="sklearn")
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import blocks
+import pred_level
+import schemas
+
+COLUMNS = ["state", "District Name", "block", *schemas.LEVEL.columns, blocks.STAGE_COLUMN]
+ROWS = [
+    ["AN", "Nicobar", "Car Nicobar", 1.0, 2.0, 3.0, 40.0, 4.0, 36.0, 8.3],
+    ["AN", "Nicobar", "Nancowry", 2.0, 10.0, 12.0, 30.0, -9999.0, 27.0, 44.4],
+    ["AN", "South Andaman", "Ferrargunj", *[-9999.0] * 7],
+    ["GJ", "Surat", "Bardoli", 50.0, 900.0, 950.0, 1000.0, 50.0, 950.0, 100.0],
+    ["GJ", "Surat", "Mahuva", 30.0, 500.0, 530.0, 800.0, 40.0, 760.0, 69.7],
+]
+
+
+def expected_rollup(df):
+    # What the state rollup should be, computed row by row with pandas.
+    values = df[list(schemas.LEVEL.columns)].mask(df[list(schemas.LEVEL.columns)] < 0)
+    observed = df[blocks.STAGE_COLUMN].mask(df[blocks.STAGE_COLUMN] < 0)
+    complete = values.notna().all(axis=1)
+    predicted = pd.Series(np.nan, index=df.index)
+    predicted[complete] = pred_level.predict_matrix(values[complete].to_numpy(np.float64))
+    frame = pd.DataFrame(
+        {
+            "state": df["state"],
+            "observed": observed,
+            "predicted": predicted,
+            "classification": predicted.map(
+                lambda p: None if np.isnan(p) else pred_level.classify_stage(p)
+            ),
+            **{name: values[column] for name, column in blocks.TOTALS.items()},
+        }
+    )
+    grouped = frame.groupby("state")
+    return {
+        state: {
+            "rows": len(group),
+            "mean_observed_stage": group["observed"].mean(),
+            "mean_predicted_stage": group["predicted"].mean(),
+            "classification": group["classification"].value_counts().to_dict(),
+            **{name: group[name].sum() for name in blocks.TOTALS},
+        }
+        for state, group in grouped
+    }
+
+
+def check_rollup(table, df, state):
+    [group] = table.rollup("state", state=state)
+    expected = expected_rollup(df)[state]
+    assert group["rows"] == expected["rows"]
+    for name in ("mean_observed_stage", "mean_predicted_stage", *blocks.TOTALS):
+        assert group[name] == pytest.approx(expected[name], rel=1e-9), name
+    counts = {label: count for label, count in group["classification"].items() if count}
+    assert counts == expected["classification"]
+
+
+def test_missing_values_are_left_out_of_rollups(tmp_path):
+    path = tmp_path / "gwr.csv"
+    df = pd.DataFrame(ROWS, columns=COLUMNS)
+    df.to_csv(path, index=False)
+    table = blocks.read_table(str(path))
+
+    check_rollup(table, df, "AN")
+    check_rollup(table, df, "GJ")
+
+    lo, hi = table.exact_range("AN", "South Andaman", "Ferrargunj")
+    [record] = table.records(lo, hi)
+    assert record["observed_stage"] is None
+    assert record["predicted_stage"] is None
+    assert record["classification"] is None
+
+
+def test_dataset_rollup_matches_pandas():
+    path = next((p for p in blocks.DEFAULT_PATHS if os.path.exists(p)), None)
+    if path is None:
+        pytest.skip("gwr.csv not available")
+    df = pd.read_csv(path)
+    for column in [*schemas.LEVEL.columns, blocks.STAGE_COLUMN]:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    df["state"] = df["state"].str.strip()
+    table = blocks.read_table(path)
+
+    check_rollup(table, df, "AN")
+
+
+def test_malformed_first_load_is_not_retried_until_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "gwr.csv"
+    path.write_text("state,block\nAN,Car Nicobar\n")
+    store = blocks.BlockStore(str(path))
+    reads = []
+    read_table = blocks.read_table
+    monkeypatch.setattr(blocks, "read_table", lambda *a: reads.append(a) or read_table(*a))
+
+    assert store.current() is None
+    assert store.current() is None
+    assert len(reads) == 1
+
+    pd.DataFrame(ROWS, columns=COLUMNS).to_csv(path, index=False)
+    assert len(store.current()) == len(ROWS)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pytest
+
+import tree_engine
+
+
+def training_data(seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(0, 100, size=(2000, 5))
+    y = X[:, 0] * 2 + np.sin(X[:, 1]) * 10 + (X[:, 2] > 50) * 30 + rng.normal(size=len(X))
+    return X, y
+
+
+def rows(X, seed=1):
+    # Training rows, fresh rows and rows with missing values.
+    rng = np.random.default_rng(seed)
+    fresh = rng.uniform(-10, 110, size=(500, X.shape[1]))
+    missing = fresh.copy()
+    missing[rng.random(missing.shape) < 0.2] = np.nan
+    return np.vstack([X[:500], fresh, missing])
+
+
+def sklearn_forest():
+    from sklearn.ensemble import RandomForestRegressor
+
+    X, y = training_data()
+    model = RandomForestRegressor(n_estimators=30, max_depth=8, random_state=0).fit(X, y)
+    return model, tree_engine.from_sklearn_forest(model), X
+
+
+def xgboost_model():
+    xgboost = pytest.importorskip("xgboost")
+
+    X, y = training_data()
+    model = xgboost.XGBRegressor(n_estimators=40, max_depth=5, learning_rate=0.1).fit(X, y)
+    return model, tree_engine.from_xgboost(model), X
+
+
+@pytest.fixture(params=["sklearn", "xgboost"])
+def compiled(request):
+    return sklearn_forest() if request.param == "sklearn" else xgboost_model()
+
+
+@pytest.mark.parametrize("walk", ["numba", "numpy"])
+def test_predictions_match_the_model_exactly(compiled, walk, monkeypatch):
+    model, ensemble, X = compiled
+    if walk == "numpy":
+        monkeypatch.setattr(tree_engine, "compiled_walk", lambda: None)
+    elif tree_engine.compiled_walk() is None:
+        pytest.skip("numba not installed")
+    X = rows(X)
+    np.testing.assert_array_equal(ensemble.predict(X), model.predict(X))
+    # The batch size does not change a row's prediction.
+    np.testing.assert_array_equal(ensemble.predict(X[:1]), model.predict(X[:1]))
+
+
+def test_contributions_add_up_to_the_prediction(compiled):
+    model, ensemble, X = compiled
+    X = rows(X)
+    contributions, bias = ensemble.contributions(X)
+    np.testing.assert_allclose(contributions.sum(axis=1) + bias, model.predict(X), rtol=1e-5, atol=1e-4)
+
+
+@pytest.mark.parametrize(
+    "tables, pickle", [("gw_quality_trees", "gw_quality.pkl"), ("gw_level_trees", "gw_level.pkl")]
+)
+def test_served_tables_match_their_models(tables, pickle):
+    tables, pickle = os.path.join("models", tables), os.path.join("models", pickle)
+    if not os.path.exists(pickle):
+        pytest.skip(f"{pickle} not available")
+    ensemble = tree_engine.load_for(tables, pickle)
+    assert ensemble is not None, f"{tables} was not exported from {pickle}"
+
+    import joblib
+
+    model = joblib.load(pickle)
+    # Values just either side of each feature's own split thresholds.
+    rng = np.random.default_rng(0)
+    columns = []
+    for j in range(len(ensemble.feature_names)):
+        thresholds = ensemble.threshold[ensemble.feature == j]
+        if len(thresholds) == 0:
+            columns.append(rng.normal(size=2000))
+        else:
+            columns.append(rng.choice(thresholds, size=2000) * rng.uniform(0.99, 1.01, size=2000))
+    X = np.column_stack(columns)
+    if hasattr(model, "feature_names_in_"):
+        import pandas as pd
+
+        expected = model.predict(pd.DataFrame(X, columns=model.feature_names_in_))
+    else:
+        expected = model.predict(X)
+    np.testing.assert_array_equal(ensemble.predict(X), expected)
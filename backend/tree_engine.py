@@ -0,0 +1,375 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import logs
+import numpy as np
+
+# Flat, array-backed tree ensembles. Every tree of a model is stored in one
+# set of node tables (feature, threshold, children, value, ...) with `roots`
+# giving each tree's first node. Leaves point at themselves, so a batch of
+# rows can be walked through all trees at once with a fixed number of
+# vectorized steps.
+
+# The compiled trees win by skipping the libraries' per-call overhead; on
+# large batches their native tree walk is faster, so callers hand those back
+# to the original model. Both paths give identical predictions (see
+# TreeEnsemble.predict and `export_trees.py --check`), so the switch is
+# invisible to callers.
+COMPILED_MAX_ROWS = int(os.environ.get("AIGIS_COMPILED_MAX_ROWS", "1024"))
+
+ARRAYS = [
+    "feature",
+    "threshold",
+    "left",
+    "right",
+    "default_left",
+    "value",
+    "cover",
+    "roots",
+]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TreeEnsemble:
+    def __init__(self, arrays, meta):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.split = meta["split"]
+        self.aggregate = meta["aggregate"]
+        self.base_score = float(meta.get("base_score", 0.0))
+        self.max_depth = int(meta["max_depth"])
+        self.feature_names = meta.get("feature_names")
+        self._node_value = None
+        self.is_leaf = self.feature < 0
+        # Leaves read feature 0 during traversal; the result is discarded
+        # because their children point back at themselves.
+        self.safe_feature = np.where(self.is_leaf, 0, self.feature)
+        # children[2 * node + go_right] replaces two gathers and a select.
+        self.children = np.ascontiguousarray(np.stack([self.left, self.right], axis=1).ravel())
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def leaves(self, X, chunk_rows=256):
+        X = _prepare(X)
+        out = np.empty((len(X), self.n_trees), dtype=np.int32)
+        walk = compiled_walk()
+        if walk is not None:
+            walk(
+                X,
+                self.roots,
+                self.feature,
+                self.threshold,
+                self.children,
+                self.default_left,
+                self.split == "le",
+                out,
+            )
+            return out
+
+        # Rows are walked in chunks so the node index block stays in cache.
+        for start in range(0, len(X), chunk_rows):
+            out[start : start + chunk_rows] = self._walk(X[start : start + chunk_rows])
+        return out
+
+    def _walk(self, X):
+        flat_X = X.ravel()
+        row_offset = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            node, _ = self._step(flat_X, row_offset, node)
+        return node
+
+    def _step(self, flat_X, row_offset, node):
+        cell = row_offset + self.safe_feature[node]
+        x = flat_X[cell]
+        threshold = self.threshold[node]
+        if self.split == "le":
+            go_right = x > threshold
+        else:
+            go_right = x >= threshold
+        missing = np.isnan(x)
+        if missing.any():
+            go_right = np.where(missing, ~self.default_left[node], go_right)
+        return self.children[2 * node + go_right], cell
+
+    def node_values(self):
+        # Expected prediction at every node. sklearn stores it for internal
+        # nodes too; XGBoost only keeps leaf weights, so internal nodes get the
+        # cover-weighted mean of their children, deepest nodes first.
+        if self._node_value is not None:
+            return self._node_value
+        if self.meta.get("kind") == "sklearn_forest":
+            self._node_value = np.asarray(self.value)
+            return self._node_value
+
+        values = np.array(self.value, dtype=np.float64)
+        depth = _node_depths(self.left, self.right, self.roots, len(values))
+        internal = np.flatnonzero(~self.is_leaf)
+        for d in range(self.max_depth - 1, -1, -1):
+            nodes = internal[depth[internal] == d]
+            left, right = self.left[nodes], self.right[nodes]
+            left_cover, right_cover = self.cover[left], self.cover[right]
+            values[nodes] = (values[left] * left_cover + values[right] * right_cover) / (
+                left_cover + right_cover
+            )
+        self._node_value = values
+        return values
+
+    def contributions(self, X):
+        # Saabas attributions: along each decision path, the change in node
+        # value at a split is credited to the split feature. Per row they sum
+        # to prediction - bias, like SHAP values, but need one tree walk
+        # instead of SHAP's path enumeration.
+        X = _prepare(X)
+        node_value = self.node_values()
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        row_offset = (np.arange(n_rows) * n_features)[:, None]
+        node = np.broadcast_to(self.roots, (n_rows, self.n_trees)).copy()
+        contribs = np.zeros(n_rows * n_features)
+        for _ in range(self.max_depth):
+            child, cell = self._step(flat_X, row_offset, node)
+            # Leaves point at themselves, so finished paths add zero.
+            delta = node_value[child] - node_value[node]
+            contribs += np.bincount(cell.ravel(), weights=delta.ravel(), minlength=len(contribs))
+            node = child
+
+        bias = float(node_value[self.roots].sum())
+        contribs = contribs.reshape(n_rows, n_features)
+        if self.aggregate == "mean":
+            return contribs / self.n_trees, bias / self.n_trees
+        return contribs, bias + self.base_score
+
+    def predict(self, X):
+        # Leaf values are added tree by tree in the libraries' own order and
+        # precision (cumsum is sequential, unlike sum's pairwise summation), so
+        # results are identical to the native predict whatever the batch size:
+        # sklearn adds float64 predictions and divides by the tree count,
+        # XGBoost adds float32 leaves onto the float32 base score.
+        leaf_values = self.value[self.leaves(X)]
+        if self.aggregate == "mean":
+            return np.cumsum(leaf_values, axis=1)[:, -1] / self.n_trees
+        margin = np.empty((len(leaf_values), self.n_trees + 1), dtype=np.float32)
+        margin[:, 0] = self.base_score
+        margin[:, 1:] = leaf_values
+        return np.cumsum(margin, axis=1, dtype=np.float32)[:, -1].astype(np.float64)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+
+
+def _prepare(X):
+    # Both sklearn and XGBoost compare float32 feature values, so inputs are
+    # rounded the same way before walking the trees.
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    return X.astype(np.float32).astype(np.float64)
+
+
+def _walk_rows(X, roots, feature, threshold, children, default_left, split_le, out):
+    # Rows are handled in blocks and each block is walked tree by tree,
+    # so a tree's nodes stay in cache while every row of the block uses it.
+    block = 64
+    n_blocks = (X.shape[0] + block - 1) // block
+    for b in range(n_blocks):
+        stop = min((b + 1) * block, X.shape[0])
+        for t in range(roots.shape[0]):
+            for i in range(b * block, stop):
+                node = roots[t]
+                while feature[node] >= 0:
+                    x = X[i, feature[node]]
+                    if np.isnan(x):
+                        go_right = not default_left[node]
+                    elif split_le:
+                        go_right = x > threshold[node]
+                    else:
+                        go_right = x >= threshold[node]
+                    node = children[2 * node + go_right]
+                out[i, t] = node
+
+
+# numba takes seconds to import, so _walk_rows is only jitted on the first
+# tree walk (the warm-up, or the preload in the gunicorn master) rather than
+# whenever this module is imported. Without numba the numpy walk is used.
+jitted_walk = None
+jit_checked = False
+jit_lock = threading.Lock()
+
+
+def compiled_walk():
+    global jitted_walk, jit_checked
+    if not jit_checked:
+        with jit_lock:
+            if not jit_checked:
+                try:
+                    import numba
+                except ImportError:
+                    pass
+                else:
+                    jitted_walk = numba.njit(nogil=True, cache=True)(_walk_rows)
+                jit_checked = True
+    return jitted_walk
+
+
+def load(directory, mmap_mode="r"):
+    # Node tables are memory-mapped read-only by default, so the page cache
+    # backs them and worker processes share one copy.
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in ARRAYS
+    }
+    return TreeEnsemble(arrays, meta)
+
+
+def load_for(directory, source_path, mmap_mode="r"):
+    # Returns None (and the caller falls back to the pickled model) unless the
+    # compiled trees were exported from exactly this model file.
+    if os.environ.get("AIGIS_COMPILED_TREES", "1") == "0":
+        return None
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+
+    ensemble = load(directory, mmap_mode=mmap_mode)
+    if ensemble.meta.get("source_sha256") != file_sha256(source_path):
+        logs.event(logs.get("tree_engine"), "stale_compiled_trees", logging.WARNING, directory=directory)
+        return None
+    return ensemble
+
+
+def _node_depths(left, right, roots, n_nodes):
+    depth = np.zeros(n_nodes, dtype=np.int32)
+    frontier = np.asarray(roots)
+    d = 0
+    while len(frontier):
+        depth[frontier] = d
+        children = np.concatenate([left[frontier], right[frontier]])
+        frontier = children[children != np.concatenate([frontier, frontier])]
+        d += 1
+    return depth
+
+
+def _tree_depths(left, right, roots):
+    depth = 0
+    frontier = np.asarray(roots)
+    while True:
+        children = np.concatenate([left[frontier], right[frontier]])
+        children = children[children != np.concatenate([frontier, frontier])]
+        if len(children) == 0:
+            return depth
+        frontier = children
+        depth += 1
+
+
+def _ensemble(parts, meta):
+    arrays = {name: [] for name in ARRAYS}
+    offset = 0
+    for part in parts:
+        n_nodes = len(part["feature"])
+        leaf = part["left"] < 0
+        own = np.arange(offset, offset + n_nodes, dtype=np.int32)
+        arrays["left"].append(np.where(leaf, own, part["left"] + offset).astype(np.int32))
+        arrays["right"].append(np.where(leaf, own, part["right"] + offset).astype(np.int32))
+        arrays["feature"].append(np.where(leaf, -1, part["feature"]).astype(np.int32))
+        for name in ("threshold", "value", "cover"):
+            arrays[name].append(np.asarray(part[name], dtype=np.float64))
+        arrays["default_left"].append(np.asarray(part["default_left"], dtype=bool))
+        arrays["roots"].append(np.array([offset], dtype=np.int32))
+        offset += n_nodes
+
+    arrays = {name: np.ascontiguousarray(np.concatenate(v)) for name, v in arrays.items()}
+    meta["max_depth"] = _tree_depths(arrays["left"], arrays["right"], arrays["roots"])
+    return TreeEnsemble(arrays, meta)
+
+
+def from_sklearn_forest(model, feature_names=None):
+    parts = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        parts.append(
+            {
+                "feature": tree.feature,
+                "threshold": tree.threshold,
+                "left": tree.children_left,
+                "right": tree.children_right,
+                "default_left": getattr(
+                    tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=bool)
+                ),
+                "value": tree.value[:, 0, 0],
+                "cover": tree.weighted_n_node_samples,
+            }
+        )
+
+    if feature_names is None and hasattr(model, "feature_names_in_"):
+        feature_names = list(model.feature_names_in_)
+    meta = {
+        "kind": "sklearn_forest",
+        "split": "le",
+        "aggregate": "mean",
+        "base_score": 0.0,
+        "feature_names": feature_names,
+    }
+    return _ensemble(parts, meta)
+
+
+def from_xgboost(model, feature_names=None):
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    learner = json.loads(booster.save_raw(raw_format="json"))["learner"]
+    gbm = learner["gradient_booster"]
+    if gbm["name"] != "gbtree":
+        raise ValueError(f"Unsupported XGBoost booster: {gbm['name']}")
+
+    trees = gbm["model"]["trees"]
+    try:
+        trees = trees[: model.best_iteration + 1]
+    except AttributeError:
+        pass
+
+    parts = []
+    for tree in trees:
+        left = np.asarray(tree["left_children"], dtype=np.int64)
+        # XGBoost stores leaf values in split_conditions; both are float32.
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        leaf = left < 0
+        parts.append(
+            {
+                "feature": np.asarray(tree["split_indices"], dtype=np.int64),
+                "threshold": np.where(leaf, 0.0, conditions),
+                "left": left,
+                "right": np.asarray(tree["right_children"], dtype=np.int64),
+                "default_left": np.asarray(tree["default_left"], dtype=bool),
+                "value": np.where(leaf, conditions, 0.0),
+                "cover": np.asarray(tree["sum_hessian"], dtype=np.float64),
+            }
+        )
+
+    base_score = learner["learner_model_param"]["base_score"].strip("[]")
+    if feature_names is None:
+        feature_names = booster.feature_names
+    meta = {
+        "kind": "xgboost",
+        "split": "lt",
+        "aggregate": "sum",
+        "base_score": float(np.float32(base_score)),
+        "feature_names": feature_names,
+    }
+    return _ensemble(parts, meta)
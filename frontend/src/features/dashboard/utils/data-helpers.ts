@@ -21,25 +21,29 @@ export const createWaterDataFromServerResponse = (inputData: WaterInputData, ser
     console.log('Parsed response keys:', Object.keys(parsedResponse))
     
     // Handle both direct properties and nested properties
-    const qualityAnalysisString = parsedResponse.quality_analysis || parsedResponse['quality_analysis']
-    const levelAnalysisString = parsedResponse.level_analysis || parsedResponse['level_analysis']
+    const qualityAnalysisValue = parsedResponse.quality_analysis || parsedResponse['quality_analysis']
+    const levelAnalysisValue = parsedResponse.level_analysis || parsedResponse['level_analysis']
     
-    console.log('Quality analysis string:', qualityAnalysisString)
-    console.log('Level analysis string:', levelAnalysisString)
+    console.log('Quality analysis value:', qualityAnalysisValue)
+    console.log('Level analysis value:', levelAnalysisValue)
     
-    // Check if the properties exist and are strings
-    if (typeof qualityAnalysisString === 'string' && qualityAnalysisString) {
-      qualityAnalysis = JSON.parse(qualityAnalysisString)
+    // The server returns objects; legacy responses nest JSON-encoded strings
+    if (typeof qualityAnalysisValue === 'string' && qualityAnalysisValue) {
+      qualityAnalysis = JSON.parse(qualityAnalysisValue)
       console.log('Parsed quality analysis:', qualityAnalysis)
+    } else if (qualityAnalysisValue && typeof qualityAnalysisValue === 'object') {
+      qualityAnalysis = qualityAnalysisValue
     } else {
-      console.warn('quality_analysis is not a valid string:', qualityAnalysisString)
+      console.warn('quality_analysis is missing:', qualityAnalysisValue)
     }
     
-    if (typeof levelAnalysisString === 'string' && levelAnalysisString) {
-      levelAnalysis = JSON.parse(levelAnalysisString)
+    if (typeof levelAnalysisValue === 'string' && levelAnalysisValue) {
+      levelAnalysis = JSON.parse(levelAnalysisValue)
       console.log('Parsed level analysis:', levelAnalysis)
+    } else if (levelAnalysisValue && typeof levelAnalysisValue === 'object') {
+      levelAnalysis = levelAnalysisValue
     } else {
-      console.warn('level_analysis is not a valid string:', levelAnalysisString)
+      console.warn('level_analysis is missing:', levelAnalysisValue)
     }
     
   } catch (error) {
@@ -1,10 +1,11 @@
-import { PredictionInputData, WaterInputData } from '../types'
+import { LevelAnalysis, PredictionInputData, QualityAnalysis, WaterInputData } from '../types'
 
 const API_BASE_URL = 'https://aigis-backend.agreeablestone-f005a4ec.southindia.azurecontainerapps.io'
 
+// Older servers (or `?legacy=true`) return each analysis as a JSON-encoded string
 export interface ServerAnalysisResponse {
-  quality_analysis: string
-  level_analysis: string
+  quality_analysis: QualityAnalysis | string
+  level_analysis: LevelAnalysis | string
 }
 
 export const analyzeWaterData = async (data: WaterInputData): Promise<ServerAnalysisResponse> => {
@@ -66,6 +67,16 @@ export const predictWaterData = async (existing: WaterInputData, prediction: Pre
   }
 }
 
+export interface ReportJob {
+  job_id: string
+  status: 'queued' | 'running' | 'done' | 'failed'
+  url?: string
+  error?: string
+}
+
+const REPORT_POLL_INTERVAL_MS = 1500
+const REPORT_TIMEOUT_MS = 5 * 60 * 1000
+
 export const generateReport = async (afterPred: ServerAnalysisResponse, language: string, reason: string): Promise<string> => {
   const response = await fetch(`${API_BASE_URL}/gen_report`, {
     method: 'POST',
@@ -85,13 +96,31 @@ export const generateReport = async (afterPred: ServerAnalysisResponse, language
     throw new Error(errorText || 'Failed to generate report')
   }
   
-  const responseData = await response.text()
-  console.log('Report generation response:', responseData)
-  
-  // Server returns a relative path like "static/report_620968327984.pdf"
-  // We need to construct the full URL
-  const relativePath = responseData.replace(/"/g, '') // Remove quotes if present
-  const fullUrl = `${API_BASE_URL}/${relativePath}`
-  
-  return fullUrl
+  const job: ReportJob = await response.json()
+  console.log('Report job queued:', job)
+
+  // The server renders the report in the background; poll until the job
+  // finishes and then build the full URL from the relative path it returns,
+  // e.g. "static/report_620968327984.pdf"
+  const deadline = Date.now() + REPORT_TIMEOUT_MS
+  while (Date.now() < deadline) {
+    await new Promise(resolve => setTimeout(resolve, REPORT_POLL_INTERVAL_MS))
+
+    const statusResponse = await fetch(`${API_BASE_URL}/gen_report/${job.job_id}`)
+    if (!statusResponse.ok) {
+      const errorText = await statusResponse.text()
+      console.error('Server error response:', errorText)
+      throw new Error(errorText || 'Failed to get report status')
+    }
+
+    const status: ReportJob = await statusResponse.json()
+    if (status.status === 'done' && status.url) {
+      return `${API_BASE_URL}/${status.url}`
+    }
+    if (status.status === 'failed') {
+      throw new Error(status.error || 'Failed to generate report')
+    }
+  }
+
+  throw new Error('Timed out waiting for report')
 }
@@ -36,10 +36,11 @@ export interface QualityAnalysis {
   rule_based_score: number
   safety_label: string
   failed_parameters: Record<string, string>
+  // null when requested with explain=none
   explanation: {
     "Predicted Score": number
     "Contributions": Record<string, number>
-  }
+  } | null
 }
 
 export interface LevelAnalysis {
@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKEND = Path(__file__).resolve().parents[1] / "backend"
+sys.path.insert(0, str(BACKEND))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# The backend loads its models relative to its own directory; --data is
+# resolved against the directory the script was started from.
+CWD = Path.cwd()
+os.chdir(BACKEND)
+
+import pred_quality
+from export_trees import parity_samples
+
+# Compares the explanation modes served by /analyze?explain=... on the same
+# rows: per-row latency of each mode and how far "fast" (Saabas) lands from
+# exact SHAP.
+#
+#   python compare_explanations.py --samples 500
+#   python compare_explanations.py --data datasets/gwq.csv
+
+
+def load_rows(data, n_samples):
+    if data:
+        import pandas as pd
+
+        # Same coercion as gw_quality/groundwater_quality.py uses for training.
+        df = pd.read_csv(CWD / data, low_memory=False)
+        for c in pred_quality.features:
+            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+        return pred_quality.quality_rules.to_matrix(df)[:n_samples]
+    if pred_quality.compiled is None:
+        raise SystemExit("No compiled trees; pass --data or run export_trees.py first")
+    return parity_samples(pred_quality.compiled, n_samples)
+
+
+def time_mode(rows, mode):
+    latencies = []
+    values = []
+    for row in rows:
+        start = time.perf_counter()
+        explanation = pred_quality.explain_prediction(row[None, :], pred=0.0, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        if explanation is not None:
+            contributions = explanation["Contributions"]
+            values.append([contributions[f] for f in pred_quality.features])
+    return np.array(latencies), np.array(values)
+
+
+def top_k_overlap(a, b, k):
+    top_a = np.argsort(-np.abs(a), axis=1)[:, :k]
+    top_b = np.argsort(-np.abs(b), axis=1)[:, :k]
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare explain=exact, fast and none on the same quality rows"
+    )
+    parser.add_argument("--data", help="CSV of quality samples; default draws rows around split thresholds")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = load_rows(args.data, args.samples)
+    pred_quality.warm_up()
+
+    results = {mode: time_mode(rows, mode) for mode in ("exact", "fast", "none")}
+    exact = results["exact"][1]
+
+    print(f"{len(rows)} rows")
+    print(f"{'mode':>6} {'p50 ms':>8} {'p95 ms':>8} {'mean abs err':>13} {'max abs err':>12} {'top-' + str(args.top):>7} {'sign':>6}")
+    for mode, (latencies, values) in results.items():
+        p50, p95 = np.percentile(latencies, [50, 95])
+        if len(values) == 0:
+            print(f"{mode:>6} {p50:>8.3f} {p95:>8.3f} {'-':>13} {'-':>12} {'-':>7} {'-':>6}")
+            continue
+        error = np.abs(values - exact)
+        sign = float(np.mean(np.sign(values) == np.sign(exact)))
+        print(
+            f"{mode:>6} {p50:>8.3f} {p95:>8.3f} {error.mean():>13.4f} {error.max():>12.4f} "
+            f"{top_k_overlap(values, exact, args.top):>7.3f} {sign:>6.3f}"
+        )
+    print(f"mean |exact contribution|: {np.abs(exact).mean():.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+import tree_engine
+
+# Flattens the trained ensembles into the array-backed node tables served by
+# backend/tree_engine.py, then checks the compiled trees reproduce the
+# original model's predictions before anything is written. --check re-runs
+# that comparison on the tables and pickles already in place, e.g. after a
+# deploy, and exits non-zero if they disagree.
+#
+#   python export_trees.py --models ../backend/models
+#   python export_trees.py --models ../backend/models --check
+
+MODELS = {
+    "gw_quality.pkl": ("gw_quality_trees", tree_engine.from_sklearn_forest),
+    "gw_level.pkl": ("gw_level_trees", tree_engine.from_xgboost),
+}
+
+
+def parity_samples(ensemble, n_samples, seed=42):
+    # Draw feature values around the split thresholds actually used by the
+    # trees so both sides of most splits are exercised.
+    rng = np.random.default_rng(seed)
+    n_features = len(ensemble.feature_names)
+    X = np.empty((n_samples, n_features))
+    for j in range(n_features):
+        thresholds = ensemble.threshold[ensemble.feature == j]
+        if len(thresholds) == 0:
+            X[:, j] = rng.normal(size=n_samples)
+            continue
+        picks = rng.choice(thresholds, size=n_samples)
+        spread = np.abs(picks) * 0.01 + 1e-3
+        X[:, j] = picks + rng.uniform(-spread, spread)
+    return X
+
+
+def parity(model_path, model, ensemble, n_samples, rtol, atol):
+    X = parity_samples(ensemble, n_samples)
+    if hasattr(model, "feature_names_in_"):
+        import pandas as pd
+
+        expected = model.predict(pd.DataFrame(X, columns=model.feature_names_in_))
+    else:
+        expected = model.predict(X)
+    actual = ensemble.predict(X)
+
+    max_error = float(np.max(np.abs(expected - actual)))
+    print(
+        f"{model_path}: {ensemble.n_trees} trees, {len(ensemble.feature)} nodes, "
+        f"depth {ensemble.max_depth}, max abs error {max_error:.3g} on {n_samples} rows"
+    )
+    return np.allclose(expected, actual, rtol=rtol, atol=atol)
+
+
+def export(model_path, out_dir, compile_fn, n_samples, rtol, atol):
+    model = joblib.load(model_path)
+    ensemble = compile_fn(model)
+    ensemble.meta["source_sha256"] = tree_engine.file_sha256(model_path)
+
+    if not parity(model_path, model, ensemble, n_samples, rtol, atol):
+        raise SystemExit(f"Parity check failed for {model_path}; not exporting")
+
+    ensemble.save(out_dir)
+    print(f"Saved compiled trees to {out_dir}")
+
+
+def check(model_path, out_dir, n_samples, rtol, atol):
+    # The served pair: the .npy tables as the backend loads them (memory
+    # mapped, refused when exported from a different pickle) and the pickle.
+    ensemble = tree_engine.load_for(out_dir, model_path)
+    if ensemble is None:
+        print(f"{model_path}: no compiled trees in {out_dir} exported from this model")
+        return False
+    return parity(model_path, joblib.load(model_path), ensemble, n_samples, rtol, atol)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the models as compiled tree tables, or check existing ones"
+    )
+    parser.add_argument("--models", default=".", help="directory holding the .pkl models")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--rtol", type=float, default=1e-5)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    parser.add_argument(
+        "--check", action="store_true", help="compare the exported tables with the models"
+    )
+    args = parser.parse_args()
+
+    found = False
+    failed = []
+    for name, (out_name, compile_fn) in MODELS.items():
+        model_path = os.path.join(args.models, name)
+        if not os.path.exists(model_path):
+            continue
+        found = True
+        if args.check:
+            if not check(
+                model_path, os.path.join(args.models, out_name), args.samples, args.rtol, args.atol
+            ):
+                failed.append(name)
+            continue
+        export(
+            model_path,
+            os.path.join(args.models, out_name),
+            compile_fn,
+            args.samples,
+            args.rtol,
+            args.atol,
+        )
+
+    if not found:
+        raise SystemExit(f"No models found in {args.models}")
+    if failed:
+        raise SystemExit(f"Parity check failed for {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
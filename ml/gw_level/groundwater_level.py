@@ -1,12 +1,50 @@
+import argparse
+import hashlib
+import os
+import threading
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 from xgboost import XGBRegressor
+from xgboost.callback import TrainingCallback
 import joblib
 import optuna
+
+# The study is kept in SQLite, so an interrupted run resumes it instead of
+# starting over. Studies are keyed on a hash of the dataset: a retrain on
+# changed data starts a fresh study and never reuses trials or models fitted
+# on an older version. Trials run in parallel threads, since
+# XGBoost releases the GIL while it trains, and trials whose validation RMSE
+# falls behind are pruned early.
+#
+#   python groundwater_level.py --trials 40 --jobs 4
+#   python groundwater_level.py --trials 200 --timeout 3600   # nightly, 1h window
+parser = argparse.ArgumentParser(description="Tune and train the groundwater level model")
+parser.add_argument("--trials", type=int, default=40, help="Trial budget for the whole study")
+parser.add_argument(
+    "--timeout", type=float, default=None, help="Stop starting trials after this many seconds"
+)
+parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Trials run in parallel")
+parser.add_argument("--storage", default="sqlite:///gw_level_study.db")
+parser.add_argument("--study-name", default="gw_level", help="Prefix; the dataset hash is appended")
+parser.add_argument(
+    "--trial-models", default="gw_level_trials", help="Where the best trial's model is kept"
+)
+args = parser.parse_args()
+
+DATASET = "datasets/gwr.csv"
+# Bump when the splits below change, so studies scored on the old validation
+# split are not resumed.
+SPLIT_VERSION = 2
+
+with open(DATASET, "rb") as f:
+    data_hash = hashlib.sha256(f.read() + f"split-{SPLIT_VERSION}".encode()).hexdigest()[:12]
+study_name = f"{args.study_name}-{data_hash}"
+trial_models = os.path.join(args.trial_models, data_hash)
+
 #Loading the dataset and preprocessing it
-df = pd.read_csv("datasets/gwr.csv")
+df = pd.read_csv(DATASET)
 df = df.dropna(axis=1, how='all')
 df = df.dropna(subset=[
     'Annual Domestic and Industry Draft',
@@ -40,7 +78,37 @@ X = X.drop(columns=[c for c in drop_cols if c in X.columns], errors='ignore')
 X_train, X_test, y_train, y_test = train_test_split(
     X, y, test_size=0.2, random_state=42
 )
+# Early stopping, pruning and trial selection use a validation split carved
+# out of the training data, so the test set stays unseen until the final
+# evaluation.
+X_fit, X_val, y_fit, y_val = train_test_split(
+    X_train, y_train, test_size=0.2, random_state=42
+)
 #Optuna hyperparameter tuning
+class PruningCallback(TrainingCallback):
+    # Reports the validation RMSE every `interval` boosting rounds and stops
+    # training as soon as the pruner gives up on the trial.
+    def __init__(self, trial, interval=10):
+        self.trial = trial
+        self.interval = interval
+        self.pruned = False
+
+    def after_iteration(self, model, epoch, evals_log):
+        if epoch % self.interval:
+            return False
+        self.trial.report(evals_log["validation_0"]["rmse"][-1], epoch)
+        self.pruned = self.trial.should_prune()
+        return self.pruned
+
+
+# Only the best model so far is kept on disk; the final model is that file
+# rather than a refit with the best parameters.
+os.makedirs(trial_models, exist_ok=True)
+best_lock = threading.Lock()
+best_saved = {"rmse": np.inf, "path": None}
+threads_per_trial = max(1, (os.cpu_count() or 1) // args.jobs)
+
+
 def objective(trial):
     params = {
         'n_estimators': trial.suggest_int('n_estimators', 500, 2000, step=100),
@@ -51,28 +119,101 @@ def objective(trial):
         'reg_alpha': trial.suggest_float('reg_alpha', 1e-8, 10.0, log=True),
         'reg_lambda': trial.suggest_float('reg_lambda', 1e-8, 10.0, log=True)
     }
-    model = XGBRegressor(**params, random_state=42, objective='reg:squarederror', early_stopping_rounds=50)
-    model.fit(X_train, y_train, eval_set=[(X_test, y_test)], verbose=False)
-    preds = model.predict(X_test)
-    rmse = np.sqrt(mean_squared_error(y_test, preds))
+    pruning = PruningCallback(trial)
+    model = XGBRegressor(
+        **params,
+        random_state=42,
+        objective='reg:squarederror',
+        early_stopping_rounds=50,
+        n_jobs=threads_per_trial,
+        callbacks=[pruning],
+    )
+    model.fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False)
+    if pruning.pruned:
+        raise optuna.TrialPruned()
+    preds = model.predict(X_val)
+    rmse = np.sqrt(mean_squared_error(y_val, preds))
+
+    with best_lock:
+        if rmse < best_saved["rmse"]:
+            path = os.path.join(trial_models, f"trial_{trial.number}.ubj")
+            model.save_model(path)
+            previous = best_saved["path"]
+            if previous and previous != path and os.path.exists(previous):
+                os.remove(previous)
+            best_saved.update(rmse=rmse, path=path)
+            trial.set_user_attr("model_path", path)
     return rmse
 
 print("Running Optuna optimization... This may take a while.")
-study = optuna.create_study(direction='minimize')
-study.optimize(objective, n_trials=40) 
-print("\nBest RMSE:", study.best_value)
+storage = optuna.storages.RDBStorage(
+    args.storage, engine_kwargs={"connect_args": {"timeout": 60}}
+)
+study = optuna.create_study(
+    study_name=study_name,
+    storage=storage,
+    load_if_exists=True,
+    direction='minimize',
+    sampler=optuna.samplers.TPESampler(seed=42),
+    pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=100),
+)
+# Pruned trials count towards the budget as well.
+counted = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+finished = [t for t in study.trials if t.state in counted]
+if len(finished) >= args.trials:
+    print(f"Study '{study_name}' already used its {args.trials} trial budget on this dataset")
+elif finished:
+    print(f"Resuming study '{study_name}' with {len(finished)} finished trials")
+else:
+    print(f"Starting study '{study_name}'")
+complete = [t for t in study.trials if t.state == optuna.trial.TrialState.COMPLETE]
+if complete:
+    best_saved.update(rmse=study.best_value, path=study.best_trial.user_attrs.get("model_path"))
+
+study.optimize(
+    objective,
+    n_trials=max(args.trials - len(finished), 0),
+    timeout=args.timeout,
+    n_jobs=args.jobs,
+    callbacks=[optuna.study.MaxTrialsCallback(args.trials, states=counted)],
+    # A failing trial is logged and recorded as failed rather than ending
+    # the whole run; the summary below reports how many there were.
+    catch=(Exception,),
+)
+pruned = [t for t in study.trials if t.state == optuna.trial.TrialState.PRUNED]
+failed = [t for t in study.trials if t.state == optuna.trial.TrialState.FAIL]
+complete = [t for t in study.trials if t.state == optuna.trial.TrialState.COMPLETE]
+print(f"\n{len(study.trials)} trials, {len(pruned)} pruned, {len(failed)} failed")
+if not complete:
+    raise SystemExit(
+        f"No trial of study '{study_name}' completed, so there is no model to save. "
+        "Raise --trials, or pass a new --study-name to start over."
+    )
+print("Best validation RMSE:", study.best_value)
 print("Best Parameters:", study.best_params)
-best_params = study.best_params
-best_params.update({'random_state': 42, 'objective': 'reg:squarederror'})
-model = XGBRegressor(**best_params)
-model.fit(X_train, y_train)
 
-# Evaluation
+model_path = study.best_trial.user_attrs.get("model_path")
+if model_path and os.path.exists(model_path):
+    # Early-stopped at the best round on X_val; predictions and
+    # export_trees.py both stop at best_iteration.
+    model = XGBRegressor()
+    model.load_model(model_path)
+else:
+    # The best trial's model is missing (e.g. a study started before models
+    # were kept), so fall back to refitting with its parameters.
+    best_params = study.best_params
+    best_params.update(
+        {'random_state': 42, 'objective': 'reg:squarederror', 'early_stopping_rounds': 50}
+    )
+    model = XGBRegressor(**best_params)
+    model.fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False)
+
+# Evaluation on the held-out test set, which no trial has seen
 y_pred = model.predict(X_test)
 r2 = r2_score(y_test, y_pred)
 mae = mean_absolute_error(y_test, y_pred)
 rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-print("\nFinal Model Performance After Optuna Tuning:")
+print("\nFinal Model Performance After Optuna Tuning (held-out test set):")
 print(f"R² Score: {r2:.4f}")
 print(f"MAE: {mae:.2f}")
 print(f"RMSE: {rmse:.2f}")
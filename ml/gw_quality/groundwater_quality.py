@@ -9,62 +9,24 @@ from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.inspection import permutation_importance
 import joblib
+import sys
+from pathlib import Path
+
+# The potability rules live in the backend so training labels and served
+# labels come from the same code.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+import quality_rules
+from quality_rules import features, LIMITS, TOXIC
 
 path = "datasets/gwq.csv"  
 df = pd.read_csv(path, low_memory=False)
 
-features = ["pH","EC","TDS","TH","Ca","Mg","Na","K","Cl","SO4","NO3","F","U(ppb)"]
-
 for c in features:
     df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
 
-LIMITS = {
-    "pH":   (6.5, 8.5),     
-    "TDS":  500,            
-    "EC":   1500,           
-    "TH":   300,            
-    "Ca":   75,           
-    "Mg":   30,           
-    "Na":   200,            
-    "K":    12,            
-    "Cl":   250,           
-    "SO4":  250,            
-    "NO3":  45,            
-    "F":    1.5,          
-    "U(ppb)": 30            
-}
-
-TOXIC = {"NO3", "F", "U(ppb)"}
-
-def within_limit(col, val):
-    if col == "pH":
-        lo, hi = LIMITS["pH"]
-        return (val >= lo) and (val <= hi)
-    else:
-        return val <= LIMITS[col]
-
-def compute_potability_score(row):
-    checks, passed = 0, 0
-    for col in features:
-        if within_limit(col, row[col]):
-            passed += 1
-        checks += 1
-    return 100.0 * passed / checks
-
-df["PotabilityScore"] = df.apply(compute_potability_score, axis=1)
-
-def final_label(row):
-    if (row["NO3"] > LIMITS["NO3"]) or (row["F"] > LIMITS["F"]) or (row["U(ppb)"] > LIMITS["U(ppb)"]):
-        return "Critical"
-    if not (LIMITS["pH"][0] <= row["pH"] <= LIMITS["pH"][1]): return "Critical"
-    for c in features:
-        if c == "pH": 
-            continue
-        if row[c] > LIMITS[c]:
-            return "Critical"
-    return "Safe"
-
-df["FinalLabel"] = df.apply(final_label, axis=1)
+rules = quality_rules.evaluate(df[features], failures=False)
+df["PotabilityScore"] = rules.scores
+df["FinalLabel"] = rules.labels
 
 print("PotabilityScore examples:\n", df["PotabilityScore"].head(), "\n")
 print("Strict labels:\n", df["FinalLabel"].value_counts(), "\n")
@@ -172,13 +134,7 @@ plt.show()
 print("\nPermutation importances (mean):\n", pi, "\n")
 
 def recompute_rule_score(row_like_dict):
-    checks, passed = 0, 0
-    for col in features:
-        val = row_like_dict[col]
-        if within_limit(col, val):
-            passed += 1
-        checks += 1
-    return 100.0 * passed / checks
+    return float(quality_rules.evaluate(row_like_dict, failures=False).scores[0])
 
 def what_if(original_row, **changes):
     base = {c: float(original_row[c]) for c in features}
@@ -188,46 +144,25 @@ def what_if(original_row, **changes):
             raise ValueError(f"{k} not in features")
         new[k] = float(v)
 
-    base_rule = recompute_rule_score(base)
-    new_rule  = recompute_rule_score(new)
-
-    base_pred = float(best_rf.predict(pd.DataFrame([base]))[0])
-    new_pred  = float(best_rf.predict(pd.DataFrame([new]))[0])
-
-    def label_from_vals(vals):
-        if (vals["NO3"] > LIMITS["NO3"]) or (vals["F"] > LIMITS["F"]) or (vals["U(ppb)"] > LIMITS["U(ppb)"]):
-            return "Critical"
-        if not (LIMITS["pH"][0] <= vals["pH"] <= LIMITS["pH"][1]): return "Critical"
-        for c in features:
-            if c == "pH": continue
-            if vals[c] > LIMITS[c]: return "Critical"
-        return "Safe"
-
-    base_label = label_from_vals(base)
-    new_label  = label_from_vals(new)
+    both = pd.DataFrame([base, new])[features]
+    rules = quality_rules.evaluate(both, failures=False)
+    base_pred, new_pred = (float(p) for p in best_rf.predict(both))
+    base_rule, new_rule = (float(s) for s in rules.scores)
 
     return {
         "base_rule_score": base_rule,
         "new_rule_score": new_rule,
         "base_model_pred": base_pred,
         "new_model_pred": new_pred,
-        "base_label": base_label,
-        "new_label": new_label,
+        "base_label": rules.labels[0],
+        "new_label": rules.labels[1],
         "delta_rule": new_rule - base_rule,
         "delta_model": new_pred - base_pred
     }
 
 
 def failed_parameters(row):
-    fails = {}
-    if not (LIMITS["pH"][0] <= row["pH"] <= LIMITS["pH"][1]):
-        fails["pH"] = f"{row['pH']} (limit {LIMITS['pH'][0]}–{LIMITS['pH'][1]})"
-    for c in features:
-        if c == "pH":
-            continue
-        if row[c] > LIMITS[c]:
-            fails[c] = f"{row[c]} (limit {LIMITS[c]})"
-    return fails if fails else {"Status": "All within limits"}
+    return quality_rules.evaluate(row).failed[0]
 
 
 explainer = shap.TreeExplainer(best_rf)